@@ -1,7 +1,12 @@
 from django.contrib import admin
 
+from mysite.fts import FTSAdminSearchMixin
+
 from .models import Article
+from .search import ARTICLES_INDEX
 
 @admin.register(Article)
-class ArticleAdmin(admin.ModelAdmin):
-    list_display = 'title', 'author', 'content', 'pub_date', 'category'
\ No newline at end of file
+class ArticleAdmin(FTSAdminSearchMixin, admin.ModelAdmin):
+    list_display = 'title', 'author', 'content', 'pub_date', 'category'
+    search_fields = 'title', 'content'
+    search_index = ARTICLES_INDEX
\ No newline at end of file
@@ -0,0 +1,5 @@
+from mysite.fts import FTSIndex
+
+from .models import Article
+
+ARTICLES_INDEX = FTSIndex(Article, ['title', 'content'], weights=[10.0, 1.0])
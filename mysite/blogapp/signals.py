@@ -0,0 +1,10 @@
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .search import ARTICLES_INDEX
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    if sender.name == 'blogapp':
+        ARTICLES_INDEX.ensure(using)
@@ -1,3 +1,25 @@
+from unittest.mock import patch
+
 from django.test import TestCase
+from django.urls import reverse
+
+from .models import Article, Author, Category
+from .search import ARTICLES_INDEX
+
+
+class ArticleSearchTestCase(TestCase):
+    def setUp(self) -> None:
+        author = Author.objects.create(name='Author', bio='')
+        category = Category.objects.create(name='Category')
+        self.django = Article.objects.create(title='Django tips', content='Caching', author=author, category=category)
+        self.other = Article.objects.create(title='Cooking', content='About django ponies', author=author, category=category)
+        Article.objects.create(title='Gardening', author=author, category=category)
+
+    def test_search_ranked(self):
+        response = self.client.get(reverse('blogapp:articles-list'), {'q': 'djan'})
+        self.assertEqual(list(response.context['articles']), [self.django, self.other])
 
-# Create your tests here.
+    def test_search_without_fts_matches_content(self):
+        with patch.object(ARTICLES_INDEX, 'available', return_value=False):
+            response = self.client.get(reverse('blogapp:articles-list'), {'q': 'django'})
+        self.assertEqual({article.pk for article in response.context['articles']}, {self.django.pk, self.other.pk})
@@ -1,8 +1,10 @@
+from django.db.models import Q
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView
 from django.contrib.syndication.views import Feed
 from django.urls import reverse, reverse_lazy
 from .models import Article
+from .search import ARTICLES_INDEX
 
 
 class ArticleListView(ListView):
@@ -15,8 +17,20 @@ class ArticleListView(ListView):
         queryset = queryset.select_related('author', 'category')
         queryset = queryset.prefetch_related('tags')
         queryset = queryset.defer('content')
+        search = self.request.GET.get('q')
+        if search:
+            if ARTICLES_INDEX.available(queryset.db):
+                queryset = ARTICLES_INDEX.search(queryset, [search])
+            else:
+                # те же поля, что в индексе
+                queryset = queryset.filter(Q(title__icontains=search) | Q(content__icontains=search))
         return queryset
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['search'] = self.request.GET.get('q', '')
+        return context
+
 
 class ArticleDetailView(DetailView):
     model = Article
@@ -0,0 +1,151 @@
+"""
+Полнотекстовый поиск на виртуальных таблицах SQLite FTS5, общий для приложений.
+
+Индекс - external content таблица FTS5 поверх таблицы модели.
+Синхронизацию выполняют триггеры SQLite, поэтому индекс обновляется и при
+bulk_create, queryset.update и удалении каскадом, которые не отправляют сигналы.
+Таблицу и триггеры создаёт FTSIndex.ensure из обработчика post_migrate.
+Триггеры пропадают, когда миграция пересоздаёт таблицу модели, тогда
+ensure восстанавливает их и перестраивает индекс.
+
+На других СУБД поиск откатывается к обычному LIKE по search_fields.
+"""
+import re
+from typing import Iterable
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Model, QuerySet, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+TERM_RE = re.compile(r'\w+')
+
+
+class FTSIndex:
+    """
+    Описание FTS5 индекса для текстовых полей модели.
+    weights - веса колонок для bm25, чем больше, тем важнее совпадение
+    """
+    tokenizer = 'unicode61 remove_diacritics 2'
+    # префиксные индексы для запросов term*
+    prefix = '2 3'
+
+    def __init__(self, model: type[Model], fields: Iterable[str], weights: Iterable[float] | None = None):
+        self.model = model
+        self.fields = list(fields)
+        self.weights = list(weights) if weights is not None else [1.0] * len(self.fields)
+
+    @property
+    def table(self) -> str:
+        return f'{self.model._meta.db_table}_fts'
+
+    @property
+    def columns(self) -> list[str]:
+        return [self.model._meta.get_field(name).column for name in self.fields]
+
+    def trigger_names(self) -> list[str]:
+        return [f'{self.table}_{suffix}' for suffix in ('ai', 'ad', 'au')]
+
+    def available(self, using: str = DEFAULT_DB_ALIAS) -> bool:
+        return connections[using].vendor == 'sqlite'
+
+    def create_sql(self) -> list[str]:
+        content = self.model._meta.db_table
+        rowid = self.model._meta.pk.column
+        columns = ', '.join(self.columns)
+        new_values = ', '.join(f'new.{column}' for column in self.columns)
+        old_values = ', '.join(f'old.{column}' for column in self.columns)
+        insert_trigger, delete_trigger, update_trigger = self.trigger_names()
+        return [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5("
+            f"{columns}, content='{content}', content_rowid='{rowid}', "
+            f"tokenize='{self.tokenizer}', prefix='{self.prefix}')",
+            f"CREATE TRIGGER IF NOT EXISTS {insert_trigger} AFTER INSERT ON {content} BEGIN "
+            f"INSERT INTO {self.table}(rowid, {columns}) VALUES (new.{rowid}, {new_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {delete_trigger} AFTER DELETE ON {content} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, {columns}) "
+            f"VALUES ('delete', old.{rowid}, {old_values}); END",
+            f"CREATE TRIGGER IF NOT EXISTS {update_trigger} AFTER UPDATE OF {columns} ON {content} BEGIN "
+            f"INSERT INTO {self.table}({self.table}, rowid, {columns}) "
+            f"VALUES ('delete', old.{rowid}, {old_values}); "
+            f"INSERT INTO {self.table}(rowid, {columns}) VALUES (new.{rowid}, {new_values}); END",
+        ]
+
+    def drop_sql(self) -> list[str]:
+        return [
+            *(f'DROP TRIGGER IF EXISTS {name}' for name in self.trigger_names()),
+            f'DROP TABLE IF EXISTS {self.table}',
+        ]
+
+    def rebuild(self, using: str = DEFAULT_DB_ALIAS) -> None:
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+    def ensure(self, using: str = DEFAULT_DB_ALIAS) -> None:
+        """
+        Создаёт недостающие таблицу и триггеры. Если чего-то не было,
+        индекс мог отстать от данных и перестраивается целиком
+        """
+        if not self.available(using):
+            return
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                [self.table, *self.trigger_names()],
+            )
+            if cursor.fetchone()[0] == 4:
+                return
+            for sql in self.create_sql():
+                cursor.execute(sql)
+        self.rebuild(using)
+
+    def match_expression(self, terms: Iterable[str]) -> str:
+        """
+        Каждое слово ищется по префиксу, все слова должны встретиться
+        """
+        words = [word for term in terms for word in TERM_RE.findall(term)]
+        return ' AND '.join(f'"{word}"*' for word in words)
+
+    def search(self, queryset: QuerySet, terms: Iterable[str]) -> QuerySet:
+        """
+        Оставляет найденные строки и сортирует их по релевантности (search_rank)
+        """
+        match = self.match_expression(terms)
+        if not match:
+            return queryset
+        pk_column = f'"{self.model._meta.db_table}"."{self.model._meta.pk.column}"'
+        weights = ', '.join(str(float(weight)) for weight in self.weights)
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', (match,)),
+        ).annotate(search_rank=RawSQL(
+            f'SELECT bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND rowid = {pk_column}',
+            (match,),
+            output_field=FloatField(),
+        )).order_by('search_rank', 'pk')
+
+
+class FTSSearchFilter(SearchFilter):
+    """
+    SearchFilter через FTS5 индекс view.search_index.
+    Без индекса или не на SQLite работает как обычный SearchFilter
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        index: FTSIndex | None = getattr(view, 'search_index', None)
+        search_terms = self.get_search_terms(request)
+        if index is None or not search_terms or not index.available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+        return index.search(queryset, search_terms)
+
+
+class FTSAdminSearchMixin:
+    """
+    Поиск в админке через FTS5 индекс search_index вместо LIKE по search_fields
+    """
+    search_index: FTSIndex
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term or not self.search_index.available(queryset.db):
+            return super().get_search_results(request, queryset, search_term)
+        return self.search_index.search(queryset, [search_term]), False
@@ -64,7 +64,6 @@ INSTALLED_APPS = [
     'django.contrib.admindocs',
     'django.contrib.sitemaps',
 
-    'debug_toolbar',
     'rest_framework',
     'django_filters',
     'drf_spectacular',
@@ -87,13 +86,22 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.contrib.admindocs.middleware.XViewMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     # 'django.middleware.cache.FetchFromCacheMiddleware',
 
     'requestdataapp.middlewares.CountRequestMiddleware',
     # 'requestdataapp.middlewares.ThrottlingMiddleware',
 ]
 
+if DEBUG:
+    # middleware панели отладки только синхронный: под ASGI он переводил бы
+    # в потоки весь стек, поэтому панель (приложение, middleware и её urls
+    # в mysite.urls) подключается только при отладке
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('rest_framework'), 'debug_toolbar')
+    MIDDLEWARE.insert(
+        MIDDLEWARE.index('requestdataapp.middlewares.CountRequestMiddleware'),
+        'debug_toolbar.middleware.DebugToolbarMiddleware',
+    )
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -194,6 +202,10 @@ LOGIN_REDIRECT_URL = reverse_lazy('myauth:about-me')
 LOGIN_URL = reverse_lazy('myauth:login')
 
 REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'shopapp.fast_json.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
@@ -1,31 +1,61 @@
+import logging
 from datetime import timedelta, datetime
 from http import HTTPStatus
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.conf import settings
 from django.http import HttpRequest, HttpResponse
 
+log = logging.getLogger(__name__)
+
 
 class CountRequestMiddleware:
+    # под ASGI работает без перехода в поток, иначе async представления
+    # выполнялись бы через async_to_sync в отдельном потоке
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.request_count = 0
         self.response_count = 0
         self.exception_count = 0
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request: HttpRequest):
+    def request_started(self) -> None:
         self.request_count += 1
-        print('request count', self.request_count)
-        response = self.get_response(request)
+        log.debug('request count %s', self.request_count)
+
+    def response_finished(self) -> None:
         self.response_count += 1
-        print('response_count', self.request_count)
+        log.debug('response count %s', self.response_count)
+
+    def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.request_started()
+        response = self.get_response(request)
+        self.response_finished()
+        return response
+
+    async def __acall__(self, request: HttpRequest):
+        self.request_started()
+        response = await self.get_response(request)
+        self.response_finished()
         return response
 
 
 class ThrottlingMiddleware:
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.bucket: dict[str, datetime] = {}
         self.rate_ms = settings.THROTTLING_RATE_MS
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     @classmethod
     def get_client_ip(cls, request: HttpRequest):
@@ -46,6 +76,8 @@ class ThrottlingMiddleware:
         return False
 
     def __call__(self, request: HttpRequest):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         client_ip = self.get_client_ip(request)
         if self.request_is_allowed(client_ip):
             response = self.get_response(request)
@@ -53,3 +85,12 @@ class ThrottlingMiddleware:
         else:
             response = HttpResponse("Rate limit exceeded", status=HTTPStatus.TOO_MANY_REQUESTS)
         return response
+
+    async def __acall__(self, request: HttpRequest):
+        client_ip = self.get_client_ip(request)
+        if self.request_is_allowed(client_ip):
+            response = await self.get_response(request)
+            self.bucket[client_ip] = datetime.utcnow()
+        else:
+            response = HttpResponse("Rate limit exceeded", status=HTTPStatus.TOO_MANY_REQUESTS)
+        return response
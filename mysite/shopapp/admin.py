@@ -1,15 +1,19 @@
 from django.contrib import admin
 from django.db.models import QuerySet
 from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
+from django.shortcuts import render, get_object_or_404
 from django.urls import path
+from django.utils import timezone
 
-from .common import save_csv_products, save_csv_orders
-from .models import Product, Order, ProductImage
-from .admin_mixins import ExportAsCSVMixin
-from .forms import CSVImportForm
-
+from mysite.fts import FTSAdminSearchMixin
 
+from .facets import track_facet_counts
+from .models import Product, Order, ProductImage, ImportJob, DailySales
+from .order_totals import recompute_order_totals
+from .admin_mixins import ExportAsCSVMixin, ImportCSVJobMixin
+from .search import PRODUCTS_INDEX
+from .signals import orders_users_versions
+from .versioning import bump_version, bump_versions_on_commit, PRODUCTS_VERSION
 
 
 class OrderInLine(admin.TabularInline):
@@ -21,21 +25,27 @@ class ProductInLine(admin.StackedInline):
 
 @admin.action(description='Archived products')
 def mark_archived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    with track_facet_counts(queryset.values_list('pk', flat=True)):
+        queryset.update(archived=True, updated_at=timezone.now())
+    bump_version(PRODUCTS_VERSION)
 
 
 @admin.action(description='Unarchived products')
 def mark_unarchived(modeladmin: admin.ModelAdmin, request: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    with track_facet_counts(queryset.values_list('pk', flat=True)):
+        queryset.update(archived=False, updated_at=timezone.now())
+    bump_version(PRODUCTS_VERSION)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+class ProductAdmin(FTSAdminSearchMixin, admin.ModelAdmin, ExportAsCSVMixin, ImportCSVJobMixin):
+    import_kind = ImportJob.Kind.PRODUCTS
     change_list_template = 'shopapp/products_changelist.html'
     actions = [
         mark_archived,
         mark_unarchived,
-        'export_csv'
+        'export_csv',
+        'export_csv_gzip',
     ]
     inlines = [
         OrderInLine,
@@ -46,9 +56,10 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     list_display_links = 'pk', 'name'
     ordering = 'name', 'pk'
     search_fields = 'name', 'description'
+    search_index = PRODUCTS_INDEX
     fieldsets = [
         (None, {
-            'fields': ('name', 'description')
+            'fields': ('name', 'sku', 'description')
         }),
         ('Price options', {
             'fields': ('price', 'discount'),
@@ -71,32 +82,20 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
             return obj.description
         return obj.description[:48] + '...'
 
-    def import_csv(self, request: HttpRequest) -> HttpResponse:
-        if request.method == 'GET':
-            form = CSVImportForm()
-            context = {
-                'form': form,
-            }
-            return render(request, 'admin/csv_form.html', context)
-        form = CSVImportForm(request.POST, request.FILES)
-        if not form.is_valid():
-            context = {
-                'form': form,
-            }
-            return render(request, 'admin/csv_form.html', context, status=400)
-        save_csv_products(
-            file = form.files['csv_file'].file,
-            encoding=request.encoding,
-        )
-        self.message_user(request, "Data from CSV was imported")
-        return redirect('..')
+    def save_related(self, request, form, formsets, change):
+        # инлайн заказов пишет строки связи напрямую, без m2m_changed
+        orders_ids = set(form.instance.orders.values_list('pk', flat=True)) if change else set()
+        super().save_related(request, form, formsets, change)
+        orders_ids.update(form.instance.orders.values_list('pk', flat=True))
+        recompute_order_totals(orders_ids)
+        bump_versions_on_commit(orders_users_versions(orders_ids))
 
     def get_urls(self):
         urls = super().get_urls()
         new_urls = [
             path(
                 'import-products-csv/',
-                self.import_csv,
+                self.admin_site.admin_view(self.import_csv),
                 name='import_products_csv'
             ),
         ]
@@ -109,12 +108,13 @@ class ProductInLine(admin.StackedInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(admin.ModelAdmin, ImportCSVJobMixin):
+    import_kind = ImportJob.Kind.ORDERS
     change_list_template = 'shopapp/orders_changelist.html'
     inlines = [
         ProductInLine
     ]
-    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose'
+    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose', 'items_count', 'total'
 
     def get_queryset(self, request):
         return Order.objects.select_related('user').prefetch_related('products')
@@ -122,35 +122,70 @@ class OrderAdmin(admin.ModelAdmin):
     def user_verbose(self, obj: Order) -> str:
         return obj.user.first_name or obj.user.username
 
-    def import_csv(self, request: HttpRequest) -> HttpResponse:
-        if request.method == 'GET':
-            form = CSVImportForm()
-            context = {
-                'form': form,
-            }
-            return render(request, 'admin/csv_form.html', context)
-        form = CSVImportForm(request.POST, request.FILES)
-        if not form.is_valid():
-            context = {
-                'form': form,
-            }
-            return render(request, 'admin/csv_form.html', context, status=400)
-        save_csv_orders(
-            file = form.files['csv_file'].file,
-            encoding=request.encoding,
-        )
-        self.message_user(request, "Data from CSV was imported")
-        return redirect('..')
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # инлайн товаров пишет строки связи напрямую, без m2m_changed
+        recompute_order_totals([form.instance.pk])
 
     def get_urls(self):
         urls = super().get_urls()
         new_urls = [
             path(
                 'import-orders-csv/',
-                self.import_csv,
+                self.admin_site.admin_view(self.import_csv),
                 name='import_orders_csv'
             ),
         ]
         return new_urls + urls
 
+@admin.register(DailySales)
+class DailySalesAdmin(admin.ModelAdmin):
+    list_display = 'day', 'orders', 'items', 'revenue'
+    date_hierarchy = 'day'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = 'pk', 'kind', 'status', 'rows_processed', 'rows_rejected', 'throughput_verbose', 'created_at'
+    list_display_links = 'pk', 'kind'
+    list_filter = 'kind', 'status'
+    readonly_fields = (
+        'kind', 'status', 'file', 'encoding', 'rows_processed', 'rows_rejected',
+        'errors', 'created_by', 'created_at', 'started_at', 'heartbeat_at', 'finished_at',
+    )
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    @admin.display(description='rows/s')
+    def throughput_verbose(self, obj: ImportJob) -> str:
+        return f'{obj.throughput:.1f}'
+
+    def job_status(self, request: HttpRequest, pk: int) -> HttpResponse:
+        job = get_object_or_404(ImportJob, pk=pk)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f'Import job #{job.pk}',
+            'job': job,
+        }
+        return render(request, 'admin/import_job_status.html', context)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        new_urls = [
+            path(
+                '<int:pk>/status/',
+                self.admin_site.admin_view(self.job_status),
+                name='shopapp_importjob_status'
+            ),
+        ]
+        return new_urls + urls
+
 # admin.site.register(Product, ProductAdmin)
@@ -0,0 +1,168 @@
+"""
+Аналитика продаж: выручка по дням, топ товаров, средний размер корзины.
+
+Колонки заказов и позиций загружаются двумя запросами values_list,
+агрегаты по группам считаются векторно в NumPy (bincount по индексам групп).
+Без NumPy те же агрегаты считаются словарями за один проход по строкам.
+Суммы считаются в копейках (int), чтобы не терять точность на float.
+"""
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+
+from django.db.models import Count, F, IntegerField, Max, QuerySet
+from django.db.models.functions import Cast, Round, TruncDate
+
+from .models import Order, Product
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TOP_PRODUCTS = 10
+
+
+@dataclass
+class SalesAggregates:
+    days: list[date]
+    day_orders: list[int]
+    day_cents: list[int]
+    # (product_id, quantity, cents) по убыванию выручки
+    top_products: list[tuple[int, int, int]]
+    orders: int
+    items: int
+    cents: int
+
+
+def load_sales_rows(orders: QuerySet) -> tuple[list[tuple], list[tuple]]:
+    """
+    Строки заказов (pk, день) и позиций (order_id, product_id, цена в копейках)
+    """
+    order_rows = list(orders.order_by().values_list('pk', TruncDate('created_at')))
+    item_rows = list(
+        Order.products.through.objects
+        .filter(order__in=orders.order_by().values('pk'))
+        .order_by()
+        .values_list('order_id', 'product_id', Cast(Round(F('product__price') * 100), IntegerField()))
+    )
+    return order_rows, item_rows
+
+
+def numpy_aggregates(order_rows: list[tuple], item_rows: list[tuple], top: int) -> SalesAggregates:
+    if not order_rows:
+        return SalesAggregates([], [], [], [], orders=0, items=0, cents=0)
+    order_ids = np.fromiter((row[0] for row in order_rows), dtype=np.int64, count=len(order_rows))
+    days = np.array([row[1] for row in order_rows], dtype='datetime64[D]')
+    items = np.array(item_rows, dtype=np.int64).reshape(-1, 3)
+
+    unique_days, day_index = np.unique(days, return_inverse=True)
+    day_orders = np.bincount(day_index, minlength=len(unique_days))
+
+    # индекс заказа для каждой позиции; позиции заказов, созданных
+    # между двумя запросами, отбрасываются
+    sorter = np.argsort(order_ids)
+    positions = np.searchsorted(order_ids, items[:, 0], sorter=sorter).clip(max=len(order_ids) - 1)
+    item_order_index = sorter[positions]
+    known = order_ids[item_order_index] == items[:, 0]
+    items = items[known]
+    item_order_index = item_order_index[known]
+    cents = items[:, 2]
+
+    # веса bincount - float64, суммы копеек точны до 2**53
+    day_cents = np.bincount(day_index[item_order_index], weights=cents, minlength=len(unique_days))
+
+    product_ids, product_index = np.unique(items[:, 1], return_inverse=True)
+    quantity = np.bincount(product_index, minlength=len(product_ids))
+    product_cents = np.rint(np.bincount(product_index, weights=cents, minlength=len(product_ids))).astype(np.int64)
+    # по убыванию выручки, при равенстве по pk
+    ranked = np.lexsort((product_ids, -product_cents))[:top]
+
+    return SalesAggregates(
+        days=unique_days.tolist(),
+        day_orders=day_orders.tolist(),
+        day_cents=np.rint(day_cents).astype(np.int64).tolist(),
+        top_products=list(zip(
+            product_ids[ranked].tolist(), quantity[ranked].tolist(), product_cents[ranked].tolist(),
+        )),
+        orders=len(order_ids),
+        items=len(items),
+        cents=int(cents.sum()),
+    )
+
+
+def python_aggregates(order_rows: list[tuple], item_rows: list[tuple], top: int) -> SalesAggregates:
+    order_days = dict(order_rows)
+    by_day: dict[date, list[int]] = {}
+    for day in order_days.values():
+        by_day.setdefault(day, [0, 0])[0] += 1
+    by_product: dict[int, list[int]] = {}
+    items = cents = 0
+    for order_id, product_id, price_cents in item_rows:
+        day = order_days.get(order_id)
+        if day is None:
+            continue
+        by_day[day][1] += price_cents
+        product = by_product.setdefault(product_id, [0, 0])
+        product[0] += 1
+        product[1] += price_cents
+        items += 1
+        cents += price_cents
+    days = sorted(by_day)
+    top_products = sorted(by_product.items(), key=lambda item: (-item[1][1], item[0]))[:top]
+    return SalesAggregates(
+        days=days,
+        day_orders=[by_day[day][0] for day in days],
+        day_cents=[by_day[day][1] for day in days],
+        top_products=[(product_id, quantity, total) for product_id, (quantity, total) in top_products],
+        orders=len(order_days),
+        items=items,
+        cents=cents,
+    )
+
+
+def money(cents: int | Decimal) -> str:
+    return str((Decimal(cents) / 100).quantize(Decimal('0.01')))
+
+
+def sales_summary(orders: QuerySet, top: int = TOP_PRODUCTS, use_numpy: bool | None = None) -> dict:
+    """
+    Сводка продаж по заказам queryset.
+    use_numpy=None - NumPy, если он установлен
+    """
+    if use_numpy is None:
+        use_numpy = np is not None
+    order_rows, item_rows = load_sales_rows(orders)
+    compute = numpy_aggregates if use_numpy else python_aggregates
+    aggregates = compute(order_rows, item_rows, top)
+
+    orders_count = aggregates.orders or 1
+    names = dict(
+        Product.objects
+        .filter(pk__in=[product_id for product_id, __, __ in aggregates.top_products])
+        .values_list('pk', 'name')
+    ) if aggregates.top_products else {}
+    return {
+        'orders': aggregates.orders,
+        'items': aggregates.items,
+        'revenue': money(aggregates.cents),
+        'average_basket_size': round(aggregates.items / orders_count, 2),
+        'average_basket_value': money(Decimal(aggregates.cents) / orders_count),
+        'revenue_by_day': [
+            {'day': day.isoformat(), 'orders': count, 'revenue': money(cents)}
+            for day, count, cents in zip(aggregates.days, aggregates.day_orders, aggregates.day_cents)
+        ],
+        'top_products': [
+            {'pk': product_id, 'name': names.get(product_id), 'quantity': quantity, 'revenue': money(cents)}
+            for product_id, quantity, cents in aggregates.top_products
+        ],
+    }
+
+
+def sales_state(orders: QuerySet) -> tuple:
+    """
+    Состояние заказов для ключа кэша: новые, удалённые и изменённые заказы
+    (в том числе состав и цены товаров, см. shopapp.order_totals) его меняют
+    """
+    state = orders.order_by().aggregate(count=Count('pk'), updated_at=Max('updated_at'))
+    return state['count'], state['updated_at']
@@ -1,56 +1,351 @@
+from contextlib import nullcontext
 from csv import DictReader
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
 from io import TextIOWrapper
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Sequence
 
+import django
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Model, Q
+from django.utils import timezone
 
+from shopapp.facets import apply_facet_deltas, facet_deltas, track_facet_counts
 from shopapp.models import Product, Order
+from shopapp.order_totals import recompute_order_totals, recompute_products_orders
+from shopapp.versioning import bump_versions_on_commit, user_orders_version, PRODUCTS_VERSION
 
+PRODUCTS_BATCH_SIZE = 1000
+MAX_PRICE = Decimal('999999.99')
+SMALLINT_RANGE = range(-32768, 32768)
+ORDERS_BATCH_SIZE = 1000
+THROUGH_BATCH_SIZE = 5000
+PRODUCT_NATURAL_KEY = ('name', 'created_by')
+PRODUCT_UPSERT_FIELDS = ('name', 'description', 'price', 'discount', 'created_by_id', 'sku')
 
-def save_csv_products(file, encoding):
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    rejected: list[tuple[int, str]] = field(default_factory=list)
+
+    @property
+    def processed(self) -> int:
+        return self.created + self.updated + self.unchanged + len(self.rejected)
+
+    def reject(self, line: int, reason: str) -> None:
+        self.rejected.append((line, reason))
+
+
+def setup_django_worker() -> None:
+    """
+    Инициализатор дочерних процессов пула (нужен при методе запуска spawn)
+    """
+    django.setup()
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def load_existing_ids(model: type[Model], ids: Iterable[int], known_ids: set[int]) -> set[int]:
+    """
+    Добавляет в known_ids существующие id модели.
+    Ещё не проверенные id запрашиваются одним запросом.
+    Возвращает id, которых нет в базе
+    """
+    missing = set(ids) - known_ids
+    if not missing:
+        return set()
+    found = set(model.objects.filter(id__in=missing).values_list('id', flat=True))
+    known_ids |= found
+    return missing - found
+
+
+def resolve_user_ids(user_ids: Iterable[int], known_ids: set[int]) -> None:
+    """
+    Проверяет, что пользователи с указанными id существуют
+    """
+    missing = load_existing_ids(User, user_ids, known_ids)
+    if missing:
+        raise User.DoesNotExist(
+            f'Users with ids {sorted(missing)} do not exist'
+        )
+
+
+def parse_product_values(values: dict[str, str]) -> tuple:
+    name = values['name'].strip()
+    if not name or len(name) > 100:
+        raise ValueError('name must be 1-100 characters')
+    try:
+        price = Decimal(values['price'] or 0).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"invalid price {values['price']!r}")
+    if not 0 <= price <= MAX_PRICE:
+        raise ValueError(f'price {price} out of range')
+    discount = int(values['discount'] or 0)
+    if discount not in SMALLINT_RANGE:
+        raise ValueError(f'discount {discount} out of range')
+    return name, values['description'], price, discount, int(values['created_by'])
+
+
+def iter_csv_products(file, encoding, batch_size: int = PRODUCTS_BATCH_SIZE) -> Iterator[list[Product]]:
+    """
+    Построчно читает CSV и сохраняет товары пачками по batch_size.
+    Отдаёт каждую сохранённую пачку, память ограничена размером пачки.
+    Транзакцию открывает вызывающий код: неизвестный пользователь в поздней
+    пачке прерывает импорт, и ранние пачки должны откатиться вместе с ней
+    """
     csv_file = TextIOWrapper(
         file,
         encoding=encoding,
     )
     reader = DictReader(csv_file)
+    known_user_ids: set[int] = set()
+
+    for rows in chunked(reader, batch_size):
+        user_ids = [int(row['created_by']) for row in rows]
+        resolve_user_ids(user_ids, known_user_ids)
+        products = [
+            Product(
+                name=row['name'],
+                description=row['description'],
+                price=row['price'],
+                discount=row['discount'],
+                created_by_id=user_id,
+            )
+            for row, user_id in zip(rows, user_ids)
+        ]
+        products = Product.objects.bulk_create(products)
+        # bulk_create не отправляет post_save
+        apply_facet_deltas(facet_deltas(products))
+        bump_versions_on_commit([PRODUCTS_VERSION])
+        yield products
+
 
+def save_csv_products(file, encoding):
     products = []
-    for row in reader:
-        user_id = int(row['created_by'])
-        user = User.objects.get(id=user_id)
-        product = Product(
-            name=row['name'],
-            description=row['description'],
-            price=row['price'],
-            discount=row['discount'],
-            created_by=user,
+    with transaction.atomic():
+        for batch in iter_csv_products(file, encoding):
+            products.extend(batch)
+
+    return products
+
+
+def stream_csv_products(file, encoding, batch_size: int = PRODUCTS_BATCH_SIZE) -> int:
+    """
+    Потоковый импорт товаров из CSV без накопления объектов в памяти,
+    весь файл в одной транзакции. Возвращает количество созданных товаров
+    """
+    with transaction.atomic():
+        return sum(
+            len(batch)
+            for batch in iter_csv_products(file, encoding, batch_size=batch_size)
         )
-        products.append(product)
 
-    Product.objects.bulk_create(products)
 
-    return products
+def upsert_csv_products(
+    file,
+    encoding,
+    key: Sequence[str] = PRODUCT_NATURAL_KEY,
+    batch_size: int = PRODUCTS_BATCH_SIZE,
+    atomic: bool = True,
+    on_batch: Callable[[ImportResult], None] | None = None,
+) -> ImportResult:
+    """
+    Идемпотентный импорт товаров из CSV.
+    Строки сопоставляются с существующими товарами по естественному ключу key
+    (например name + created_by или sku). Для каждой пачки существующие товары
+    загружаются одним запросом, новые создаются через bulk_create,
+    изменённые сохраняются через bulk_update, неизменённые не пишутся вовсе.
+    Весь файл пишется в одной транзакции, при atomic=False - каждая пачка
+    отдельно (как в save_csv_orders)
+    """
+    key_attrs = [Product._meta.get_field(name).attname for name in key]
+    csv_file = TextIOWrapper(file, encoding=encoding)
+    reader = DictReader(csv_file)
+    compared_fields = [
+        attr for attr in PRODUCT_UPSERT_FIELDS
+        if attr != 'sku' or 'sku' in (reader.fieldnames or ())
+    ]
+    known_user_ids: set[int] = set()
+    result = ImportResult()
+
+    file_atomic = transaction.atomic if atomic else nullcontext
+    batch_atomic = nullcontext if atomic else transaction.atomic
 
-def save_csv_orders(file, encoding):
+    with file_atomic():
+        for rows in chunked(enumerate(reader, start=2), batch_size):
+            incoming: dict[tuple, tuple[int, dict]] = {}
+            for line, row in rows:
+                try:
+                    name, description, price, discount, user_id = parse_product_values(row)
+                except (KeyError, ValueError) as exc:
+                    result.reject(line, str(exc))
+                    continue
+                values = {
+                    'name': name,
+                    'description': description,
+                    'price': price,
+                    'discount': discount,
+                    'created_by_id': user_id,
+                    'sku': row.get('sku') or None,
+                }
+                row_key = tuple(values[attr] for attr in key_attrs)
+                if None in row_key:
+                    result.reject(line, f'Empty natural key {key}')
+                    continue
+                if row_key in incoming:
+                    # повтор ключа в пачке: побеждает последняя строка,
+                    # вытесненная попадает в отклонённые
+                    prev_line, __ = incoming.pop(row_key)
+                    result.reject(prev_line, 'duplicate key in file')
+                incoming[row_key] = (line, values)
+
+            load_existing_ids(User, (values['created_by_id'] for __, values in incoming.values()), known_user_ids)
+            lookup = Q(**{
+                f'{attr}__in': {row_key[i] for row_key in incoming}
+                for i, attr in enumerate(key_attrs)
+            })
+            existing: dict[tuple, Product] = {}
+            if incoming:
+                # при дублях в базе обновляется самый ранний товар
+                for product in Product.objects.filter(lookup).order_by('-pk'):
+                    existing[tuple(getattr(product, attr) for attr in key_attrs)] = product
+
+            to_create = []
+            to_update = []
+            changed_fields: set[str] = set()
+            for row_key, (line, values) in incoming.items():
+                if values['created_by_id'] not in known_user_ids:
+                    result.reject(line, f"Unknown user {values['created_by_id']}")
+                    continue
+                product = existing.get(row_key)
+                if product is None:
+                    to_create.append(Product(**values))
+                    continue
+                diff = [
+                    attr for attr in compared_fields
+                    if getattr(product, attr) != values[attr]
+                ]
+                if not diff:
+                    result.unchanged += 1
+                    continue
+                for attr in diff:
+                    setattr(product, attr, values[attr])
+                changed_fields.update(diff)
+                to_update.append(product)
+
+            if to_create or to_update:
+                with batch_atomic():
+                    Product.objects.bulk_create(to_create)
+                    apply_facet_deltas(facet_deltas(to_create))
+                    if to_update:
+                        # bulk_update не заполняет auto_now поля
+                        now = timezone.now()
+                        for product in to_update:
+                            product.updated_at = now
+                        with track_facet_counts((product.pk for product in to_update), changed_fields):
+                            Product.objects.bulk_update(to_update, [*sorted(changed_fields), 'updated_at'])
+                        if 'price' in changed_fields:
+                            recompute_products_orders(product.pk for product in to_update)
+                bump_versions_on_commit([PRODUCTS_VERSION])
+            result.created += len(to_create)
+            result.updated += len(to_update)
+            if on_batch is not None:
+                on_batch(result)
+
+    result.rejected.sort()
+    return result
+
+
+def save_csv_orders(
+    file,
+    encoding,
+    batch_size: int = ORDERS_BATCH_SIZE,
+    atomic: bool = True,
+    on_batch: Callable[[ImportResult], None] | None = None,
+) -> ImportResult:
+    """
+    Массовый импорт заказов из CSV.
+    Пользователи и товары проверяются по множествам известных id,
+    заказы и связи с товарами создаются через bulk_create в одной транзакции.
+    Некорректные строки не прерывают импорт, а попадают в result.rejected
+
+    При atomic=False каждая пачка фиксируется отдельной транзакцией,
+    а on_batch вызывается после каждой пачки (для отчёта о прогрессе)
+    """
     csv_file = TextIOWrapper(file, encoding=encoding)
     reader = DictReader(csv_file)
-    rows = list(reader)
+    known_user_ids: set[int] = set()
+    known_product_ids: set[int] = set()
+    through_model = Order.products.through
+    result = ImportResult()
 
-    orders = []
-    for row in rows:
-        user_id = int(row['user'])
-        user = User.objects.get(id=user_id)
+    file_atomic = transaction.atomic if atomic else nullcontext
+    batch_atomic = nullcontext if atomic else transaction.atomic
 
-        order = Order.objects.create(
-            delivery_address=row['delivery_address'],
-            promocode=row['promocode'],
-            user=user
-        )
+    with file_atomic():
+        for rows in chunked(enumerate(reader, start=2), batch_size):
+            parsed = []
+            for line, row in rows:
+                try:
+                    order = Order(
+                        delivery_address=row['delivery_address'],
+                        promocode=row['promocode'],
+                        user_id=int(row['user']),
+                    )
+                    product_ids = list(dict.fromkeys(
+                        int(pid) for pid in row['products'].split(',') if pid.strip()
+                    ))
+                except (KeyError, ValueError, AttributeError) as exc:
+                    result.reject(line, f'Malformed row: {exc!r}')
+                    continue
+                parsed.append((line, order, product_ids))
+
+            with batch_atomic():
+                load_existing_ids(User, (item[1].user_id for item in parsed), known_user_ids)
+                load_existing_ids(
+                    Product,
+                    (pid for item in parsed for pid in item[2]),
+                    known_product_ids,
+                )
 
-        product_ids = [int(pid) for pid in row['products'].split(',')]
-        products = Product.objects.filter(id__in=product_ids)
-        order.products.set(products)
+                orders = []
+                orders_product_ids = []
+                for line, order, product_ids in parsed:
+                    if order.user_id not in known_user_ids:
+                        result.reject(line, f'Unknown user {order.user_id}')
+                        continue
+                    unknown_products = [pid for pid in product_ids if pid not in known_product_ids]
+                    if unknown_products:
+                        result.reject(line, f'Unknown products {unknown_products}')
+                        continue
+                    orders.append(order)
+                    orders_product_ids.append(product_ids)
 
-        orders.append(order)
+                Order.objects.bulk_create(orders)
+                through_model.objects.bulk_create(
+                    [
+                        through_model(order_id=order.pk, product_id=product_id)
+                        for order, product_ids in zip(orders, orders_product_ids)
+                        for product_id in product_ids
+                    ],
+                    batch_size=THROUGH_BATCH_SIZE,
+                )
+                recompute_order_totals(order.pk for order in orders)
+                result.created += len(orders)
+            # bulk_create не отправляет сигналы, версии выгрузок сбрасываются вручную
+            bump_versions_on_commit(user_orders_version(order.user_id) for order in orders)
 
-    return orders
+            if on_batch is not None:
+                on_batch(result)
 
+    result.rejected.sort()
+    return result
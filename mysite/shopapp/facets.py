@@ -0,0 +1,198 @@
+"""
+Фасеты каталога товаров: количество товаров по значениям фильтров
+(архивный, диапазон скидки, диапазон цены).
+
+Для отфильтрованного списка счётчики всех фасетов считаются одним
+GROUP BY запросом. Для каталога без фильтров счётчики хранятся
+в таблице ProductFacetCount и обновляются приращениями при записи товаров:
+одиночные save/delete - сигналами, массовые операции - явными вызовами
+apply_facet_deltas и track_facet_counts.
+"""
+from bisect import bisect_right
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, F, Q, QuerySet, Value, When
+
+from .models import Product, ProductFacetCount
+
+FacetKey = tuple[str, str]
+
+
+class BooleanFacet:
+    def __init__(self, name: str, field: str | None = None):
+        self.name = name
+        self.field = field or name
+
+    @property
+    def values(self) -> list[str]:
+        return ['false', 'true']
+
+    def label(self, value) -> str:
+        return 'true' if value else 'false'
+
+    def expression(self) -> Case:
+        return Case(
+            When(**{self.field: True}, then=Value('true')),
+            default=Value('false'),
+            output_field=CharField(),
+        )
+
+
+class RangeFacet:
+    """
+    Полуинтервалы [bounds[i], bounds[i + 1]), значения меньше bounds[0]
+    попадают в '<bounds[0]', больше последней границы - в 'bounds[-1]+'
+    """
+
+    def __init__(self, name: str, bounds: list[int], field: str | None = None):
+        self.name = name
+        self.field = field or name
+        self.bounds = bounds
+
+    @property
+    def values(self) -> list[str]:
+        return [
+            f'<{self.bounds[0]}',
+            *(f'{low}-{high}' for low, high in zip(self.bounds, self.bounds[1:])),
+            f'{self.bounds[-1]}+',
+        ]
+
+    def label(self, value) -> str:
+        # из CSV значения приходят строками
+        return self.values[bisect_right(self.bounds, Decimal(value))]
+
+    def expression(self) -> Case:
+        return Case(
+            *(
+                When(**{f'{self.field}__lt': bound}, then=Value(label))
+                for bound, label in zip(self.bounds, self.values)
+            ),
+            default=Value(self.values[-1]),
+            output_field=CharField(),
+        )
+
+
+PRODUCT_FACETS = [
+    BooleanFacet('archived'),
+    RangeFacet('discount', [0, 1, 10, 25, 50]),
+    RangeFacet('price', [0, 100, 500, 1000, 5000]),
+]
+PRODUCT_FACET_FIELDS = [facet.field for facet in PRODUCT_FACETS]
+
+
+def empty_facets() -> dict[str, dict[str, int]]:
+    return {facet.name: dict.fromkeys(facet.values, 0) for facet in PRODUCT_FACETS}
+
+
+def facet_counts(queryset: QuerySet) -> dict[str, dict[str, int]]:
+    """
+    Счётчики всех фасетов для queryset одним GROUP BY запросом
+    """
+    rows = queryset.order_by().values(**{
+        f'facet_{facet.name}': facet.expression() for facet in PRODUCT_FACETS
+    }).annotate(count=Count('pk'))
+    counts = empty_facets()
+    for row in rows:
+        for facet in PRODUCT_FACETS:
+            counts[facet.name][row[f'facet_{facet.name}']] += row['count']
+    return counts
+
+
+def stored_facet_counts() -> dict[str, dict[str, int]]:
+    counts = empty_facets()
+    for facet, value, count in ProductFacetCount.objects.values_list('facet', 'value', 'count'):
+        if facet in counts:
+            counts[facet][value] = count
+    return counts
+
+
+def facet_keys(values: dict) -> list[FacetKey]:
+    return [(facet.name, facet.label(values[facet.field])) for facet in PRODUCT_FACETS]
+
+
+def product_facet_values(product: Product) -> dict:
+    return {field: getattr(product, field) for field in PRODUCT_FACET_FIELDS}
+
+
+def facet_deltas(products: Iterable[Product], sign: int = 1) -> Counter:
+    deltas = Counter()
+    for product in products:
+        for key in facet_keys(product_facet_values(product)):
+            deltas[key] += sign
+    return deltas
+
+
+def apply_facet_deltas(deltas: Counter) -> None:
+    """
+    Все приращения применяются одним UPDATE.
+    Строки для всех значений фасетов создаются миграцией и rebuild_facet_counts,
+    недостающие (например, после flush) досоздаются
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    condition = Q()
+    cases = []
+    for (facet, value), delta in deltas.items():
+        key_condition = Q(facet=facet, value=value)
+        condition |= key_condition
+        cases.append(When(key_condition, then=Value(delta)))
+    queryset = ProductFacetCount.objects.filter(condition)
+    updated = queryset.update(count=F('count') + Case(*cases, default=Value(0)))
+    if updated == len(deltas):
+        return
+    with transaction.atomic():
+        existing = set(queryset.values_list('facet', 'value'))
+        ProductFacetCount.objects.bulk_create(
+            [
+                ProductFacetCount(facet=facet, value=value, count=delta)
+                for (facet, value), delta in deltas.items()
+                if (facet, value) not in existing
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def grouped_facet_deltas(queryset: QuerySet, sign: int = 1) -> Counter:
+    deltas = Counter()
+    for facet, values in facet_counts(queryset).items():
+        for value, count in values.items():
+            deltas[facet, value] += sign * count
+    return deltas
+
+
+def track_facet_counts(pks: Iterable[int], fields: Iterable[str] | None = None):
+    """
+    Для queryset.update и bulk_update: счётчики товаров pks до и после
+    изменения считаются GROUP BY запросами, разница применяется к таблице.
+    Если среди изменяемых fields нет полей фасетов, ничего не делает
+    """
+    if fields is not None and not set(fields) & set(PRODUCT_FACET_FIELDS):
+        return nullcontext()
+    return _track_facet_counts(pks)
+
+
+@contextmanager
+def _track_facet_counts(pks: Iterable[int]):
+    queryset = Product.objects.filter(pk__in=list(pks))
+    deltas = grouped_facet_deltas(queryset, sign=-1)
+    yield
+    deltas.update(grouped_facet_deltas(queryset))
+    apply_facet_deltas(deltas)
+
+
+def rebuild_facet_counts() -> None:
+    """
+    Полный пересчёт таблицы по всем товарам
+    """
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create(
+            ProductFacetCount(facet=facet, value=value, count=count)
+            for facet, values in facet_counts(Product.objects.all()).items()
+            for value, count in values.items()
+        )
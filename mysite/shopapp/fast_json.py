@@ -0,0 +1,78 @@
+"""
+Быстрая сериализация JSON через orjson, если он установлен.
+
+Значения кодируются так же, как стандартным путём: типы, которых orjson
+не знает или кодирует иначе (Decimal, datetime, ленивые строки перевода),
+передаются в default исходного энкодера (DjangoJSONEncoder для выгрузок,
+энкодер DRF для API).
+
+Формат вывода dumps отличается от JsonResponse и json.dumps по умолчанию:
+компактные разделители (',' и ':') и UTF-8 без \\u-экранирования,
+NaN и Infinity кодируются как null. Без orjson стандартный json вызывается
+с теми же разделителями и ensure_ascii=False, формат тот же (кроме NaN).
+Вывод FastJSONRenderer совпадает с компактным JSONRenderer из DRF побайтно.
+"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder as DRFJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # datetime отдаётся в default, чтобы формат совпадал с энкодерами Django и DRF
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+_django_default = DjangoJSONEncoder().default
+_drf_default = DRFJSONEncoder().default
+
+
+def dumps_bytes(obj) -> bytes:
+    """
+    Компактный JSON в UTF-8, значения кодируются как в DjangoJSONEncoder
+    """
+    if orjson is None:
+        return dumps(obj).encode()
+    return orjson.dumps(obj, default=_django_default, option=ORJSON_OPTIONS)
+
+
+def dumps(obj) -> str:
+    if orjson is None:
+        return json.dumps(obj, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return dumps_bytes(obj).decode()
+
+
+class FastJsonResponse(HttpResponse):
+    """
+    JsonResponse, кодирующий данные через dumps_bytes (компактный формат)
+    """
+
+    def __init__(self, data, safe: bool = True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                'In order to allow non-dict objects to be serialized set the safe parameter to False.'
+            )
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps_bytes(data), **kwargs)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer на orjson для компактного вывода без отступов.
+    Вывод с отступами (?indent, браузерный API) и ensure_ascii
+    остаются у стандартного JSONRenderer
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type or '', renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = orjson.dumps(data, default=_drf_default, option=ORJSON_OPTIONS)
+        # как в JSONRenderer: U+2028 и U+2029 недопустимы в JavaScript строках
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -28,4 +28,15 @@ class OrderForm(forms.Form):
 
 
 class CSVImportForm(forms.Form):
-    csv_file = forms.FileField()
\ No newline at end of file
+    csv_file = forms.FileField()
+    workers = forms.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=64,
+        initial=1,
+        help_text='Number of processes parsing the file (large product imports only)',
+    )
+    upsert = forms.BooleanField(
+        required=False,
+        help_text='Update products matched by name and creator instead of creating duplicates',
+    )
@@ -0,0 +1,153 @@
+"""
+Фоновое выполнение задач импорта CSV (модель ImportJob).
+
+Очередь хранится в базе данных, внешний брокер не нужен:
+команда run_import_jobs забирает ожидающие задачи и выполняет их в пуле процессов.
+"""
+import logging
+from collections.abc import Iterable
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .common import iter_csv_products, save_csv_orders, upsert_csv_products, ImportResult
+from .models import ImportJob
+from .parallel_import import parallel_import_products
+
+log = logging.getLogger(__name__)
+
+MAX_STORED_ERRORS = 100
+# задача в running без отметки дольше этого срока считается брошенной:
+# её воркер умер, не успев записать итог. Отметки внутри транзакции импорта
+# не видны до фиксации, поэтому срок берётся с запасом
+STALE_JOB_TIMEOUT = timedelta(minutes=30)
+
+
+def claim_job(job_id: int) -> bool:
+    """
+    Атомарно переводит задачу из pending в running.
+    Возвращает False, если задачу уже забрал другой воркер
+    """
+    claimed = ImportJob.objects.filter(
+        pk=job_id,
+        status=ImportJob.Status.PENDING,
+    ).update(
+        status=ImportJob.Status.RUNNING,
+        started_at=timezone.now(),
+        heartbeat_at=timezone.now(),
+    )
+    return claimed == 1
+
+
+def fail_stale_jobs(timeout: timedelta = STALE_JOB_TIMEOUT, exclude: Iterable[int] = ()) -> int:
+    """
+    Помечает failed задачи в running, от которых нет отметки дольше timeout.
+    Обратно в pending они не возвращаются: импорт без upsert частично записан,
+    и повторный запуск продублировал бы строки.
+    exclude - задачи, которые вызывающий воркер выполняет сам
+    """
+    deadline = timezone.now() - timeout
+    return ImportJob.objects.filter(
+        # задачи, взятые до появления heartbeat_at, судятся по started_at
+        Q(heartbeat_at__lt=deadline) | Q(heartbeat_at__isnull=True, started_at__lt=deadline),
+        status=ImportJob.Status.RUNNING,
+    ).exclude(
+        pk__in=list(exclude),
+    ).update(
+        status=ImportJob.Status.FAILED,
+        errors='Worker stopped responding',
+        finished_at=timezone.now(),
+    )
+
+
+def fail_job(job_id: int, errors: str) -> None:
+    ImportJob.objects.filter(pk=job_id, status=ImportJob.Status.RUNNING).update(
+        status=ImportJob.Status.FAILED,
+        errors=errors,
+        finished_at=timezone.now(),
+    )
+
+
+def claim_pending_jobs(limit: int) -> list[int]:
+    pending_ids = (
+        ImportJob.objects
+        .filter(status=ImportJob.Status.PENDING)
+        .order_by('created_at')
+        .values_list('pk', flat=True)[:limit]
+    )
+    return [job_id for job_id in pending_ids if claim_job(job_id)]
+
+
+def report_progress(job_id: int, rows_processed: int, rows_rejected: int = 0) -> None:
+    ImportJob.objects.filter(pk=job_id).update(
+        rows_processed=rows_processed,
+        rows_rejected=rows_rejected,
+        heartbeat_at=timezone.now(),
+    )
+
+
+def format_rejected(result: ImportResult) -> str:
+    lines = [
+        f'Line {line}: {reason}'
+        for line, reason in result.rejected[:MAX_STORED_ERRORS]
+    ]
+    if len(result.rejected) > MAX_STORED_ERRORS:
+        lines.append(f'... and {len(result.rejected) - MAX_STORED_ERRORS} more')
+    return '\n'.join(lines)
+
+
+def import_job_file(job: ImportJob) -> ImportResult:
+    def on_batch(result: ImportResult) -> None:
+        report_progress(job.pk, result.processed, len(result.rejected))
+
+    if job.kind == ImportJob.Kind.PRODUCTS and job.upsert:
+        with job.file.open('rb') as file:
+            return upsert_csv_products(file, encoding=job.encoding, atomic=False, on_batch=on_batch)
+
+    if job.kind == ImportJob.Kind.PRODUCTS and job.workers > 1:
+        return parallel_import_products(
+            job.file.path,
+            encoding=job.encoding,
+            workers=job.workers,
+            on_batch=on_batch,
+        )
+
+    with job.file.open('rb') as file:
+        if job.kind == ImportJob.Kind.ORDERS:
+            return save_csv_orders(file, encoding=job.encoding, atomic=False, on_batch=on_batch)
+        result = ImportResult()
+        # неизвестный пользователь прерывает такой импорт, поэтому файл
+        # пишется целиком или никак; прогресс виден после фиксации
+        with transaction.atomic():
+            for batch in iter_csv_products(file, encoding=job.encoding):
+                result.created += len(batch)
+                on_batch(result)
+        return result
+
+
+def run_import_job(job_id: int) -> str:
+    """
+    Выполняет одну задачу импорта, уже переведённую в running.
+    Вызывается в дочернем процессе пула
+    """
+    close_old_connections()
+    job = ImportJob.objects.get(pk=job_id)
+    try:
+        result = import_job_file(job)
+    except Exception as exc:
+        log.exception('Import job %s failed', job.pk)
+        status = ImportJob.Status.FAILED
+        errors = f'{type(exc).__name__}: {exc}'
+    else:
+        report_progress(job.pk, result.processed, len(result.rejected))
+        status = ImportJob.Status.DONE
+        errors = format_rejected(result)
+
+    ImportJob.objects.filter(pk=job.pk).update(
+        status=status,
+        errors=errors,
+        finished_at=timezone.now(),
+    )
+    return status
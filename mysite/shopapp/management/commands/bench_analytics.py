@@ -0,0 +1,119 @@
+from decimal import Decimal
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from shopapp import analytics
+from shopapp.analytics import money, sales_summary
+from shopapp.models import Product, Order
+
+
+class Rollback(Exception):
+    pass
+
+
+def orm_loop_summary(queryset: QuerySet, top: int) -> dict:
+    """
+    Та же сводка обходом заказов по одному, как в команде agg
+    """
+    by_day = {}
+    by_product = {}
+    orders = items = cents = 0
+    for order in queryset:
+        day = timezone.localdate(order.created_at)
+        day_stats = by_day.setdefault(day, [0, 0])
+        day_stats[0] += 1
+        orders += 1
+        for product in order.products.all():
+            price_cents = int(product.price * 100)
+            day_stats[1] += price_cents
+            product_stats = by_product.setdefault(product.pk, [product.name, 0, 0])
+            product_stats[1] += 1
+            product_stats[2] += price_cents
+            items += 1
+            cents += price_cents
+    top_products = sorted(by_product.items(), key=lambda item: (-item[1][2], item[0]))[:top]
+    return {
+        'orders': orders,
+        'items': items,
+        'revenue': money(cents),
+        'average_basket_size': round(items / (orders or 1), 2),
+        'average_basket_value': money(Decimal(cents) / (orders or 1)),
+        'revenue_by_day': [
+            {'day': day.isoformat(), 'orders': count, 'revenue': money(total)}
+            for day, (count, total) in sorted(by_day.items())
+        ],
+        'top_products': [
+            {'pk': pk, 'name': name, 'quantity': quantity, 'revenue': money(total)}
+            for pk, (name, quantity, total) in top_products
+        ],
+    }
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the per-order ORM loop against the column based sales summary.
+    Data is created in a transaction that is rolled back at the end
+    """
+
+    help = 'Compare per-order ORM loop and vectorized sales analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--items', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def measure(self, label: str, rows: int, repeat: int, func) -> float:
+        best = min(self.timed(func) for __ in range(repeat))
+        self.stdout.write(f'{label:<40} {best * 1e6 / rows:8.1f} us/order')
+        return best
+
+    @staticmethod
+    def timed(func) -> float:
+        start = default_timer()
+        func()
+        return default_timer() - start
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        products_count = max(rows // 10, 1)
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username='bench-analytics')
+                products = Product.objects.bulk_create(
+                    Product(name=f'Product {i}', price=f'{i % 1000}.{i % 100:02}', created_by=user)
+                    for i in range(products_count)
+                )
+                orders = Order.objects.bulk_create(Order(user=user) for __ in range(rows))
+                Order.products.through.objects.bulk_create(
+                    Order.products.through(order_id=order.pk, product_id=products[(i * 7 + j) % products_count].pk)
+                    for i, order in enumerate(orders)
+                    for j in range(options['items'])
+                )
+
+                queryset = Order.objects.filter(user=user)
+                expected = orm_loop_summary(queryset, analytics.TOP_PRODUCTS)
+                orm_time = self.measure(
+                    'ORM loop', rows, repeat, lambda: orm_loop_summary(queryset, analytics.TOP_PRODUCTS),
+                )
+                backends = [('python', False)]
+                if analytics.np is not None:
+                    backends.append(('numpy', True))
+                else:
+                    self.stdout.write(self.style.WARNING('numpy is not installed, only the python backend is measured'))
+                for name, use_numpy in backends:
+                    if sales_summary(queryset, use_numpy=use_numpy) != expected:
+                        self.stdout.write(self.style.ERROR(f'{name}: result differs from the ORM loop'))
+                    summary_time = self.measure(
+                        f'sales_summary ({name})', rows, repeat,
+                        lambda: sales_summary(queryset, use_numpy=use_numpy),
+                    )
+                    self.stdout.write(f'{name}: speedup x{orm_time / summary_time:.1f}')
+                raise Rollback
+        except Rollback:
+            pass
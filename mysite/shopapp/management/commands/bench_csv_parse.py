@@ -0,0 +1,41 @@
+import os
+from tempfile import NamedTemporaryFile
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+
+from shopapp.parallel_import import iter_parsed_chunks
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of the parallel CSV parsing stage (no database writes)
+    """
+
+    help = 'Measure product CSV parsing throughput for different worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        with NamedTemporaryFile('w', suffix='.csv', encoding='utf-8') as file:
+            file.write('name,description,price,discount,created_by\n')
+            for i in range(options['rows']):
+                file.write(f'Product {i},"Description, number {i}",{i % 1000}.99,{i % 50},1\n')
+            file.flush()
+            size_mb = os.path.getsize(file.name) / 1024 / 1024
+            self.stdout.write(f"{options['rows']} rows, {size_mb:.1f} MB")
+
+            baseline = None
+            workers = 1
+            while workers <= options['max_workers']:
+                start = default_timer()
+                rows = sum(len(chunk.rows) for __, chunk in iter_parsed_chunks(file.name, 'utf-8', workers))
+                elapsed = default_timer() - start
+                baseline = baseline or elapsed
+                self.stdout.write(
+                    f'workers={workers:<3} {elapsed:7.2f} s  '
+                    f'{rows / elapsed:12,.0f} rows/s  speedup x{baseline / elapsed:.2f}'
+                )
+                workers *= 2
@@ -0,0 +1,77 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.translation import gettext_lazy as _
+from rest_framework.renderers import JSONRenderer
+
+from shopapp import fast_json
+from shopapp.fast_json import FastJSONRenderer
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of JSON encoding of product rows: stdlib json against fast_json (orjson)
+    """
+
+    help = 'Compare stdlib and orjson based JSON encoding for exports and API responses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=50_000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def measure(self, label: str, rows: int, repeat: int, func) -> float:
+        best = min(self.timed(func) for __ in range(repeat))
+        self.stdout.write(f'{label:<40} {best * 1e6 / rows:8.2f} us/row')
+        return best
+
+    @staticmethod
+    def timed(func) -> float:
+        start = default_timer()
+        func()
+        return default_timer() - start
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        if fast_json.orjson is None:
+            self.stdout.write(self.style.WARNING('orjson is not installed, fast_json falls back to stdlib json'))
+
+        created = datetime(2023, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+        # как в выгрузках: Decimal и datetime как есть
+        export_rows = [
+            {
+                'pk': i,
+                'name': f'Product {i}',
+                'price': Decimal(i % 1000) + Decimal('0.99'),
+                'archived': bool(i % 2),
+                'created_at': created,
+                'status': _('Products'),
+            }
+            for i in range(rows)
+        ]
+        # как в API: данные сериализатора, цены уже строками
+        api_data = {
+            'count': rows,
+            'results': [
+                {**row, 'price': str(row['price']), 'created_at': created.isoformat(), 'status': str(row['status'])}
+                for row in export_rows
+            ],
+        }
+
+        stdlib_time = self.measure(
+            'exports: json + DjangoJSONEncoder', rows, repeat,
+            lambda: [json.dumps(row, cls=DjangoJSONEncoder) for row in export_rows],
+        )
+        fast_time = self.measure(
+            'exports: fast_json.dumps', rows, repeat,
+            lambda: [fast_json.dumps(row) for row in export_rows],
+        )
+        self.stdout.write(f'exports: speedup x{stdlib_time / fast_time:.1f}')
+
+        stdlib_time = self.measure('api: JSONRenderer', rows, repeat, lambda: JSONRenderer().render(api_data))
+        fast_time = self.measure('api: FastJSONRenderer', rows, repeat, lambda: FastJSONRenderer().render(api_data))
+        self.stdout.write(f'api: speedup x{stdlib_time / fast_time:.1f}')
@@ -0,0 +1,78 @@
+from timeit import default_timer
+
+from django.contrib.auth.models import User
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from shopapp.models import Product, Order
+from shopapp.serializers import ProductSerializer, OrderSerializer, ValuesRowSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Benchmark of ModelSerializer against ValuesRowSerializer on generated data.
+    Data is created in a transaction that is rolled back at the end
+    """
+
+    help = 'Compare per-row cost of ModelSerializer and ValuesRowSerializer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def measure(self, label: str, rows: int, repeat: int, func) -> float:
+        best = min(self.timed(func) for __ in range(repeat))
+        self.stdout.write(f'{label:<40} {best * 1e6 / rows:8.1f} us/row')
+        return best
+
+    @staticmethod
+    def timed(func) -> float:
+        start = default_timer()
+        func()
+        return default_timer() - start
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        repeat = options['repeat']
+        request = Request(APIRequestFactory().get('/shop/api/'))
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(username='bench-serializers')
+                products = Product.objects.bulk_create(
+                    Product(name=f'Product {i}', description='Description', price=i % 1000, created_by=user)
+                    for i in range(rows)
+                )
+                orders = Order.objects.bulk_create(Order(user=user, delivery_address='Address') for __ in range(rows))
+                Order.products.through.objects.bulk_create(
+                    Order.products.through(order_id=order.pk, product_id=products[i % rows].pk)
+                    for i, order in enumerate(orders)
+                )
+
+                for name, serializer_class, queryset, model_queryset in (
+                    ('products', ProductSerializer, Product.objects.all(), Product.objects.all()),
+                    ('orders', OrderSerializer, Order.objects.all(), Order.objects.prefetch_related('products')),
+                ):
+                    context = {'request': request}
+                    model_time = self.measure(
+                        f'{name}: ModelSerializer',
+                        rows,
+                        repeat,
+                        lambda: serializer_class(model_queryset, many=True, context=context).data,
+                    )
+                    values_serializer = ValuesRowSerializer(serializer_class(context=context))
+                    fast_time = self.measure(
+                        f'{name}: ValuesRowSerializer',
+                        rows,
+                        repeat,
+                        lambda: values_serializer.serialize(list(queryset.values(*values_serializer.columns))),
+                    )
+                    self.stdout.write(f'{name}: speedup x{model_time / fast_time:.1f}')
+                raise Rollback
+        except Rollback:
+            pass
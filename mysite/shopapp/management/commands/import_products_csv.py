@@ -0,0 +1,55 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from shopapp.parallel_import import parallel_import_products
+from shopapp.common import upsert_csv_products, PRODUCTS_BATCH_SIZE, PRODUCT_NATURAL_KEY
+
+
+class Command(BaseCommand):
+    """
+    Import products from a large CSV file, parsing it in several processes
+    """
+
+    help = 'Import products from CSV with parallel parsing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path to the CSV file')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of parsing processes')
+        parser.add_argument('--batch-size', type=int, default=PRODUCTS_BATCH_SIZE,
+                            help='Rows per bulk insert')
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument('--upsert', action='store_true',
+                            help='Update existing products matched by --key instead of creating duplicates')
+        parser.add_argument('--key', default=','.join(PRODUCT_NATURAL_KEY),
+                            help='Comma separated natural key fields for --upsert, e.g. "sku"')
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['path']):
+            raise CommandError(f"File {options['path']} does not exist")
+
+        if options['upsert']:
+            key = options['key'].split(',')
+            self.stdout.write(f'Upsert products by key {key}')
+            with open(options['path'], 'rb') as file:
+                result = upsert_csv_products(
+                    file,
+                    encoding=options['encoding'],
+                    key=key,
+                    batch_size=options['batch_size'],
+                )
+        else:
+            self.stdout.write(f"Import products with {options['workers']} workers")
+            result = parallel_import_products(
+                options['path'],
+                encoding=options['encoding'],
+                workers=options['workers'],
+                batch_size=options['batch_size'],
+            )
+        for line, reason in result.rejected:
+            self.stderr.write(f'Line {line} rejected: {reason}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.created}, updated {result.updated}, unchanged {result.unchanged} products, '
+            f'rejected {len(result.rejected)} rows'
+        ))
@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from shopapp.facets import rebuild_facet_counts, stored_facet_counts
+
+
+class Command(BaseCommand):
+    """
+    Recalculate the ProductFacetCount table from scratch
+    """
+
+    help = 'Rebuild stored product facet counts'
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        for facet, values in stored_facet_counts().items():
+            self.stdout.write(f'{facet}: {values}')
+        self.stdout.write(self.style.SUCCESS('Product facet counts rebuilt'))
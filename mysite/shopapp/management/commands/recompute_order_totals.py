@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from shopapp.order_totals import recompute_all_order_totals, RECOMPUTE_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Recalculate Order.total and Order.items_count from the order products
+    """
+
+    help = 'Recompute denormalized order totals in batches and fix drifted orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=RECOMPUTE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        fixed = recompute_all_order_totals(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Order totals recomputed, {fixed} orders fixed'))
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+
+from shopapp.rollups import reset_rollups, run_rollup, ROLLUP_LAG
+
+
+class Command(BaseCommand):
+    """
+    Catch up daily sales rollups: add orders created after the stored watermark
+    and recompute the days with late edits
+    """
+
+    help = 'Update daily sales rollup tables incrementally'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag', type=int, default=int(ROLLUP_LAG.total_seconds()),
+            help='Seconds the watermark stays behind now, for orders in uncommitted transactions',
+        )
+        parser.add_argument('--full', action='store_true', help='Drop the rollups and process the whole history')
+
+    def handle(self, *args, **options):
+        if options['full']:
+            reset_rollups()
+        result = run_rollup(lag=timedelta(seconds=options['lag']))
+        self.stdout.write(f'New orders: {result.orders}')
+        if result.recomputed_days:
+            days = ', '.join(day.isoformat() for day in result.recomputed_days)
+            self.stdout.write(f'Recomputed days: {days}')
+        self.stdout.write(self.style.SUCCESS(f'Sales rollups are up to date till {result.watermark.isoformat()}'))
@@ -0,0 +1,65 @@
+import os
+import time
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from django.core.management import BaseCommand
+from django.db import connections
+
+from shopapp.common import setup_django_worker
+from shopapp.jobs import STALE_JOB_TIMEOUT, claim_pending_jobs, fail_job, fail_stale_jobs, run_import_job
+
+
+class Command(BaseCommand):
+    """
+    Worker for background CSV imports queued from the admin
+    """
+
+    help = 'Run queued CSV import jobs in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Number of worker processes')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds between checks for new jobs')
+        parser.add_argument('--once', action='store_true',
+                            help='Process pending jobs and exit')
+        parser.add_argument('--stale-timeout', type=float, default=STALE_JOB_TIMEOUT.total_seconds(),
+                            help='Seconds without progress after which a running job is marked failed')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        poll_interval = options['poll_interval']
+        stale_timeout = timedelta(seconds=options['stale_timeout'])
+        self.stdout.write(f'Start import worker with {workers} processes')
+
+        # child processes must open their own database connections
+        connections.close_all()
+        running: dict[Future, int] = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=setup_django_worker) as executor:
+            while True:
+                # jobs of this worker are tracked by their futures, not by heartbeat
+                stale = fail_stale_jobs(stale_timeout, exclude=running.values())
+                if stale:
+                    self.stderr.write(f'Marked {stale} stale import jobs as failed')
+                for job_id in claim_pending_jobs(limit=workers - len(running)):
+                    self.stdout.write(f'Start import job #{job_id}')
+                    running[executor.submit(run_import_job, job_id)] = job_id
+
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                done, __ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    if future.exception() is not None:
+                        self.stderr.write(f'Import job #{job_id} crashed: {future.exception()!r}')
+                        # the child died before recording the outcome itself
+                        fail_job(job_id, f'Worker crashed: {future.exception()!r}')
+                    else:
+                        self.stdout.write(f'Import job #{job_id} finished: {future.result()}')
+
+        self.stdout.write(self.style.SUCCESS('Done'))
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.8 on 2026-10-17 13:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0006_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='workers',
+            field=models.PositiveSmallIntegerField(default=1, verbose_name='workers'),
+        ),
+    ]
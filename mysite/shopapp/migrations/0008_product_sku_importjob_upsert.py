@@ -0,0 +1,23 @@
+# Generated by Django 4.1.8 on 2026-10-17 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0007_importjob_workers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='upsert',
+            field=models.BooleanField(default=False, verbose_name='upsert'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='sku',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name='SKU'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.8 on 2026-10-17 13:27
+
+from bisect import bisect_right
+
+from django.db import migrations, models
+
+# фасеты на момент миграции, копия shopapp.facets.PRODUCT_FACETS:
+# миграция не должна зависеть от текущего кода приложения
+DISCOUNT_BOUNDS = [0, 1, 10, 25, 50]
+PRICE_BOUNDS = [0, 100, 500, 1000, 5000]
+
+
+def range_values(bounds: list[int]) -> list[str]:
+    return [
+        f'<{bounds[0]}',
+        *(f'{low}-{high}' for low, high in zip(bounds, bounds[1:])),
+        f'{bounds[-1]}+',
+    ]
+
+
+def fill_facet_counts(apps, schema_editor):
+    Product = apps.get_model('shopapp', 'Product')
+    ProductFacetCount = apps.get_model('shopapp', 'ProductFacetCount')
+    discount_values = range_values(DISCOUNT_BOUNDS)
+    price_values = range_values(PRICE_BOUNDS)
+    counts = {
+        'archived': dict.fromkeys(['false', 'true'], 0),
+        'discount': dict.fromkeys(discount_values, 0),
+        'price': dict.fromkeys(price_values, 0),
+    }
+    rows = Product.objects.order_by().values_list('archived', 'discount', 'price').iterator(chunk_size=2000)
+    for archived, discount, price in rows:
+        counts['archived']['true' if archived else 'false'] += 1
+        counts['discount'][discount_values[bisect_right(DISCOUNT_BOUNDS, discount)]] += 1
+        counts['price'][price_values[bisect_right(PRICE_BOUNDS, price)]] += 1
+    ProductFacetCount.objects.bulk_create(
+        ProductFacetCount(facet=facet, value=value, count=count)
+        for facet, values in counts.items()
+        for value, count in values.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0009_product_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(max_length=32, verbose_name='facet')),
+                ('value', models.CharField(max_length=32, verbose_name='value')),
+                ('count', models.IntegerField(default=0, verbose_name='count')),
+            ],
+            options={
+                'verbose_name': 'Product facet count',
+                'verbose_name_plural': 'Product facet counts',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value'), name='unique_product_facet_value'),
+        ),
+        migrations.RunPython(fill_facet_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.1.8 on 2026-10-17 13:35
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    # копия shopapp.order_totals.order_totals_values на исторических моделях
+    Order = apps.get_model('shopapp', 'Order')
+    items = Order.products.through.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    Order.objects.update(
+        total=Coalesce(
+            Subquery(items.annotate(total=Sum('product__price')).values('total')),
+            Value(Decimal(0)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        items_count=Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_productfacetcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='items count'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='total'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
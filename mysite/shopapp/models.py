@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -34,6 +35,8 @@ class Product(models.Model):
     archived = models.BooleanField(default=False, verbose_name=_('archived'))
     preview = models.ImageField(null=True, blank=True, upload_to=product_preview_directory_path,
                                 verbose_name=_('preview'))
+    sku = models.CharField(max_length=64, null=True, blank=True, unique=True, verbose_name=_('SKU'))
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('updated_at'))
 
     @property
     def description_short(self) -> str:
@@ -48,6 +51,26 @@ class Product(models.Model):
         return reverse('shopapp:products_details', kwargs={'pk': self.pk})
 
 
+class ProductFacetCount(models.Model):
+    """
+    Количество товаров каталога с данным значением фасета (см. shopapp.facets)
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_product_facet_value'),
+        ]
+        verbose_name = _('Product facet count')
+        verbose_name_plural = _('Product facet counts')
+
+    facet = models.CharField(max_length=32, verbose_name=_('facet'))
+    value = models.CharField(max_length=32, verbose_name=_('value'))
+    count = models.IntegerField(default=0, verbose_name=_('count'))
+
+    def __str__(self) -> str:
+        return f"ProductFacetCount(facet={self.facet!r}, value={self.value!r}, count={self.count})"
+
+
 def product_images_directory_path(instance: 'ProductImage', filename: str) -> str:
     return 'products/product_{pk}/images/{filename}'.format(
         pk=instance.product.pk,
@@ -68,7 +91,134 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT, verbose_name=_('user'))
     products = models.ManyToManyField(Product, related_name="orders", verbose_name=_('products'))
     receipt = models.FileField(null=True, upload_to='orders/receipt/', verbose_name=_('receipt'))
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('updated_at'))
+    # денормализованные итоги по products, см. shopapp.order_totals
+    total = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False, verbose_name=_('total'))
+    items_count = models.PositiveIntegerField(default=0, editable=False, verbose_name=_('items count'))
 
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+
+
+class DailySales(models.Model):
+    """
+    Дневной итог продаж, заполняется командой rollup_sales (см. shopapp.rollups)
+    """
+
+    class Meta:
+        ordering = ['day']
+        verbose_name = _('Daily sales')
+        verbose_name_plural = _('Daily sales')
+
+    day = models.DateField(unique=True, verbose_name=_('day'))
+    orders = models.PositiveIntegerField(default=0, verbose_name=_('orders'))
+    items = models.PositiveIntegerField(default=0, verbose_name=_('items'))
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_('revenue'))
+
+
+class DailyProductSales(models.Model):
+    class Meta:
+        ordering = ['day', 'product']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_sales'),
+        ]
+        verbose_name = _('Daily product sales')
+        verbose_name_plural = _('Daily product sales')
+
+    day = models.DateField(db_index=True, verbose_name=_('day'))
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name=_('product'))
+    quantity = models.PositiveIntegerField(default=0, verbose_name=_('quantity'))
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_('revenue'))
+
+
+class DailyUserSales(models.Model):
+    class Meta:
+        ordering = ['day', 'user']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'user'], name='unique_daily_user_sales'),
+        ]
+        verbose_name = _('Daily user sales')
+        verbose_name_plural = _('Daily user sales')
+
+    day = models.DateField(db_index=True, verbose_name=_('day'))
+    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name=_('user'))
+    orders = models.PositiveIntegerField(default=0, verbose_name=_('orders'))
+    items = models.PositiveIntegerField(default=0, verbose_name=_('items'))
+    revenue = models.DecimalField(default=0, max_digits=14, decimal_places=2, verbose_name=_('revenue'))
+
+
+class SalesRollupState(models.Model):
+    """
+    Состояние rollup_sales (одна строка): заказы с created_at <= watermark
+    уже учтены, изменения заказов отслеживаются по updated_at > changes_since
+    """
+
+    watermark = models.DateTimeField(null=True, verbose_name=_('watermark'))
+    changes_since = models.DateTimeField(null=True, verbose_name=_('changes since'))
+
+
+class SalesRollupDirtyDay(models.Model):
+    """
+    День, итоги которого нужно пересчитать целиком (например, после удаления заказа)
+    """
+
+    day = models.DateField(unique=True, verbose_name=_('day'))
+
+
+class ImportJob(models.Model):
+    """
+    Задача фонового импорта CSV.
+    Создаётся в админке, выполняется командой run_import_jobs
+    """
+
+    class Kind(models.TextChoices):
+        PRODUCTS = 'products', _('Products')
+        ORDERS = 'orders', _('Orders')
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = _('Import job')
+        verbose_name_plural = _('Import jobs')
+
+    kind = models.CharField(max_length=20, choices=Kind.choices, verbose_name=_('kind'))
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING,
+                              db_index=True, verbose_name=_('status'))
+    file = models.FileField(upload_to='imports/', verbose_name=_('file'))
+    encoding = models.CharField(max_length=40, default='utf-8', verbose_name=_('encoding'))
+    workers = models.PositiveSmallIntegerField(default=1, verbose_name=_('workers'))
+    upsert = models.BooleanField(default=False, verbose_name=_('upsert'))
+    rows_processed = models.PositiveIntegerField(default=0, verbose_name=_('rows processed'))
+    rows_rejected = models.PositiveIntegerField(default=0, verbose_name=_('rows rejected'))
+    errors = models.TextField(blank=True, verbose_name=_('errors'))
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, verbose_name=_('created_by'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('created_at'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('started_at'))
+    heartbeat_at = models.DateTimeField(null=True, blank=True, verbose_name=_('heartbeat_at'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('finished_at'))
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
+
+    @property
+    def throughput(self) -> float:
+        """
+        Скорость импорта в строках в секунду
+        """
+        if self.started_at is None:
+            return 0.0
+        finished_at = self.finished_at or timezone.now()
+        elapsed = (finished_at - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return 0.0
+        return self.rows_processed / elapsed
+
+    def __str__(self) -> str:
+        return f"ImportJob(pk={self.pk}, kind={self.kind!r}, status={self.status!r})"
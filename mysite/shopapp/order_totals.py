@@ -0,0 +1,87 @@
+"""
+Денормализованные итоги заказа: Order.total (сумма цен товаров)
+и Order.items_count (количество товаров).
+
+Итоги пересчитываются одним UPDATE с подзапросами к таблице связи
+при изменении состава заказа (m2m_changed, удаление товара, bulk_create связей).
+Изменение цены товара применяется приращением ко всем его заказам.
+Команда recompute_order_totals пересчитывает все заказы пачками.
+"""
+from decimal import Decimal
+from typing import Iterable
+
+from django.db.models import Count, DecimalField, F, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Order
+
+RECOMPUTE_BATCH_SIZE = 1000
+
+
+def order_totals_values() -> dict:
+    """
+    Выражения для UPDATE: итоги каждого заказа по таблице связи
+    """
+    items = Order.products.through.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+    return {
+        'total': Coalesce(
+            Subquery(items.annotate(total=Sum('product__price')).values('total')),
+            Value(Decimal(0)),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        ),
+        'items_count': Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), Value(0)),
+    }
+
+
+def recompute_order_totals(orders: QuerySet | Iterable[int]) -> int:
+    """
+    Пересчитывает итоги заказов (queryset или id) и обновляет их updated_at.
+    Возвращает количество обновлённых заказов
+    """
+    if not isinstance(orders, QuerySet):
+        orders = Order.objects.filter(pk__in=list(orders))
+    return orders.update(updated_at=timezone.now(), **order_totals_values())
+
+
+def recompute_products_orders(product_ids: Iterable[int]) -> int:
+    """
+    Для bulk_update цен: пересчёт всех заказов с товарами product_ids
+    """
+    return recompute_order_totals(Order.objects.filter(products__in=list(product_ids)))
+
+
+def apply_price_change(product_id: int, delta: Decimal) -> int:
+    """
+    Цена товара изменилась на delta: total всех его заказов меняется на delta
+    """
+    if not delta:
+        return 0
+    return Order.objects.filter(products=product_id).update(
+        total=F('total') + delta,
+        updated_at=timezone.now(),
+    )
+
+
+def recompute_all_order_totals(batch_size: int = RECOMPUTE_BATCH_SIZE) -> int:
+    """
+    Пересчёт итогов всех заказов пачками по pk.
+    Обновляются только разошедшиеся заказы, возвращается их количество
+    """
+    values = order_totals_values()
+    fixed = 0
+    last_pk = 0
+    while True:
+        pks = list(
+            Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return fixed
+        drifted = (
+            Order.objects
+            .filter(pk__in=pks)
+            .alias(actual_total=values['total'], actual_items_count=values['items_count'])
+            .exclude(total=F('actual_total'), items_count=F('actual_items_count'))
+        )
+        fixed += recompute_order_totals(drifted)
+        last_pk = pks[-1]
@@ -0,0 +1,130 @@
+"""
+Пагинация для API магазина.
+
+По умолчанию работает обычная постраничная пагинация.
+Если в запросе есть параметр cursor (в том числе пустой), включается
+keyset-пагинация: страница выбирается условием WHERE по значениям
+сортировки последней строки, без COUNT и OFFSET.
+"""
+import base64
+import json
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetOrPageNumberPagination(PageNumberPagination):
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset: QuerySet, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self.get_keyset_ordering(queryset, request, view)
+        queryset = queryset.order_by(*ordering)
+
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(self.build_filter(queryset.model, ordering, self.decode_cursor(cursor)))
+
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(queryset.model, ordering, page[-1])
+        return page
+
+    def get_keyset_ordering(self, queryset: QuerySet, request, view) -> list[str]:
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or queryset.model._meta.ordering
+        ordering = [field for field in ordering if field.lstrip('-') not in ('pk', 'id')]
+        for field in ordering:
+            try:
+                model_field = queryset.model._meta.get_field(field.lstrip('-'))
+            except FieldDoesNotExist:
+                model_field = None
+            if model_field is None or not model_field.concrete or model_field.many_to_many or model_field.null:
+                raise ValidationError({
+                    'ordering': f'Ordering by {field!r} is not supported with cursor pagination',
+                })
+        # pk делает порядок однозначным при равных значениях
+        return [*ordering, 'pk']
+
+    def build_filter(self, model, ordering: list[str], values: list) -> Q:
+        """
+        (a > x) OR (a = x AND b > y) OR ... с учётом направления сортировки
+        """
+        if len(values) != len(ordering):
+            raise ValidationError({self.cursor_query_param: 'Cursor does not match the ordering'})
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            value = self.field_to_python(model, name, value)
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def field_to_python(self, model, name: str, value):
+        field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+        try:
+            return field.to_python(value)
+        except DjangoValidationError:
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+
+    def encode_cursor(self, model, ordering: list[str], obj) -> str:
+        values = []
+        for field in ordering:
+            name = field.lstrip('-')
+            model_field = model._meta.pk if name == 'pk' else model._meta.get_field(name)
+            if isinstance(obj, dict):
+                # строка из values()
+                value = obj[name if name == 'pk' else model_field.attname]
+                values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+            else:
+                values.append(model_field.value_to_string(obj))
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, cursor: str) -> list:
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+        if not isinstance(values, list):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor'})
+        return values
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Keyset pagination cursor. Pass an empty value to get the first page without COUNT',
+            'schema': {'type': 'string'},
+        })
+        return parameters
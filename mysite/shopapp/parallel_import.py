@@ -0,0 +1,168 @@
+"""
+Параллельный импорт товаров из больших CSV файлов.
+
+Файл делится на диапазоны байт, выровненные по границам строк.
+Разбор и проверка строк (Decimal для price, int для discount) выполняются
+в пуле процессов, а сохранение в базу делает один процесс-писатель.
+
+Ограничение: значения с переводом строки внутри кавычек не поддерживаются,
+такие файлы нужно импортировать обычным save_csv_products.
+"""
+import csv
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from io import StringIO
+from typing import Callable, Iterator
+
+from django.contrib.auth.models import User
+
+from .facets import apply_facet_deltas, facet_deltas
+from .common import (ImportResult, chunked, load_existing_ids, parse_product_values,
+                     setup_django_worker, PRODUCTS_BATCH_SIZE)
+from .models import Product
+from .versioning import bump_version, PRODUCTS_VERSION
+
+PRODUCT_FIELDS = ('name', 'description', 'price', 'discount', 'created_by')
+MIN_CHUNK_SIZE = 1024 * 1024
+# разобранный диапазон целиком лежит в памяти писателя
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# разобранных, но ещё не записанных диапазонов на один процесс
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+
+@dataclass
+class ParsedChunk:
+    lines: int = 0
+    rows: list[tuple] = field(default_factory=list)
+    rejected: list[tuple[int, str]] = field(default_factory=list)
+
+
+def read_header(path: str, encoding: str) -> tuple[list[str], int]:
+    """
+    Возвращает имена колонок и смещение первой строки с данными
+    """
+    with open(path, 'rb') as file:
+        header = file.readline()
+    fieldnames = next(csv.reader([header.decode(encoding)]))
+    return fieldnames, len(header)
+
+
+def split_file(path: str, start: int, chunks: int) -> list[tuple[int, int]]:
+    """
+    Делит файл на chunks диапазонов [start, end), каждый заканчивается концом строки.
+    Размер диапазона ограничен MIN_CHUNK_SIZE и MAX_CHUNK_SIZE,
+    для больших файлов диапазонов получается больше chunks
+    """
+    size = os.path.getsize(path)
+    chunk_size = min(MAX_CHUNK_SIZE, max(MIN_CHUNK_SIZE, (size - start) // max(chunks, 1) + 1))
+    ranges = []
+    with open(path, 'rb') as file:
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline()
+            end = min(file.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_products_chunk(path: str, encoding: str, fieldnames: list[str], start: int, end: int) -> ParsedChunk:
+    """
+    Разбирает и проверяет строки одного диапазона. Выполняется в дочернем процессе
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode(encoding)
+
+    chunk = ParsedChunk()
+    for line, values in enumerate(csv.reader(StringIO(text)), start=1):
+        chunk.lines = line
+        if not values:
+            continue
+        try:
+            row = dict(zip(fieldnames, values, strict=True))
+            chunk.rows.append((line, *parse_product_values(row)))
+        except (KeyError, ValueError) as exc:
+            chunk.rejected.append((line, str(exc)))
+    return chunk
+
+
+def iter_parsed_chunks(path: str, encoding: str, workers: int) -> Iterator[tuple[int, ParsedChunk]]:
+    """
+    Отдаёт разобранные диапазоны по порядку вместе с номером первой строки диапазона
+    """
+    fieldnames, data_start = read_header(path, encoding)
+    missing = set(PRODUCT_FIELDS) - set(fieldnames)
+    if missing:
+        raise ValueError(f'CSV file has no columns {sorted(missing)}')
+    ranges = split_file(path, data_start, chunks=workers * 4)
+    first_line = 2
+
+    if workers <= 1:
+        parsed = (parse_products_chunk(path, encoding, fieldnames, start, end) for start, end in ranges)
+        for chunk in parsed:
+            yield first_line, chunk
+            first_line += chunk.lines
+        return
+
+    if not ranges:
+        return
+    # executor.map отправляет все диапазоны сразу, и при медленном писателе
+    # результаты копятся в памяти; здесь в работе не больше window диапазонов
+    window = workers * CHUNKS_IN_FLIGHT_PER_WORKER
+    pending: deque[Future] = deque()
+    ranges_iter = iter(ranges)
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_django_worker) as executor:
+        while True:
+            for start, end in ranges_iter:
+                pending.append(executor.submit(parse_products_chunk, path, encoding, fieldnames, start, end))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            chunk = pending.popleft().result()
+            yield first_line, chunk
+            first_line += chunk.lines
+
+
+def parallel_import_products(
+    path: str,
+    encoding: str = 'utf-8',
+    workers: int = 1,
+    batch_size: int = PRODUCTS_BATCH_SIZE,
+    on_batch: Callable[[ImportResult], None] | None = None,
+) -> ImportResult:
+    """
+    Импорт товаров: разбор в workers процессах, запись одним писателем пачками
+    """
+    result = ImportResult()
+    known_user_ids: set[int] = set()
+
+    for first_line, chunk in iter_parsed_chunks(path, encoding, workers):
+        for line, reason in chunk.rejected:
+            result.reject(first_line + line - 1, reason)
+        for rows in chunked(chunk.rows, batch_size):
+            load_existing_ids(User, (row[-1] for row in rows), known_user_ids)
+            products = []
+            for line, name, description, price, discount, user_id in rows:
+                if user_id not in known_user_ids:
+                    result.reject(first_line + line - 1, f'Unknown user {user_id}')
+                    continue
+                products.append(Product(
+                    name=name,
+                    description=description,
+                    price=price,
+                    discount=discount,
+                    created_by_id=user_id,
+                ))
+            Product.objects.bulk_create(products)
+            apply_facet_deltas(facet_deltas(products))
+            bump_version(PRODUCTS_VERSION)
+            result.created += len(products)
+            if on_batch is not None:
+                on_batch(result)
+
+    result.rejected.sort()
+    return result
@@ -0,0 +1,217 @@
+"""
+Дневные итоги продаж: DailySales, DailyUserSales, DailyProductSales.
+
+Команда rollup_sales обрабатывает только заказы, созданные после отметки
+SalesRollupState.watermark: их итоги группируются по дням в базе
+и прибавляются к существующим строкам. Отметка отстаёт от текущего времени
+на lag, чтобы не пропустить заказы из ещё не зафиксированных транзакций.
+
+Поздние изменения уже учтённых заказов находятся по updated_at (состав заказа
+и цены товаров меняют его, см. shopapp.order_totals), удаления отмечаются
+в SalesRollupDirtyDay сигналом. Затронутые дни пересчитываются целиком.
+Суммы берутся из денормализованных Order.total и Order.items_count.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Model, QuerySet, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .analytics import money, TOP_PRODUCTS
+from .models import (DailyProductSales, DailySales, DailyUserSales, Order, Product, SalesRollupDirtyDay,
+                     SalesRollupState)
+
+ROLLUP_LAG = timedelta(minutes=5)
+ROLLUP_BATCH_SIZE = 1000
+# модель итогов и поля её ключа
+ROLLUPS: list[tuple[type[Model], tuple[str, ...]]] = [
+    (DailySales, ('day',)),
+    (DailyUserSales, ('day', 'user_id')),
+    (DailyProductSales, ('day', 'product_id')),
+]
+
+
+@dataclass
+class RollupResult:
+    orders: int = 0
+    recomputed_days: list[date] = field(default_factory=list)
+    watermark: datetime | None = None
+
+
+def orders_rollups(orders: QuerySet) -> dict[type[Model], list[Model]]:
+    """
+    Итоги заказов queryset по дням, три GROUP BY запроса
+    """
+    orders = orders.order_by()
+    daily = orders.values(day=TruncDate('created_at')).annotate(
+        orders=Count('pk'), items=Sum('items_count'), revenue=Sum('total'),
+    )
+    users = orders.values('user_id', day=TruncDate('created_at')).annotate(
+        orders=Count('pk'), items=Sum('items_count'), revenue=Sum('total'),
+    )
+    products = (
+        Order.products.through.objects
+        .filter(order__in=orders.values('pk'))
+        .order_by()
+        .values('product_id', day=TruncDate('order__created_at'))
+        .annotate(quantity=Count('pk'), revenue=Sum('product__price'))
+    )
+    return {
+        DailySales: [DailySales(**row) for row in daily],
+        DailyUserSales: [DailyUserSales(**row) for row in users],
+        DailyProductSales: [DailyProductSales(**row) for row in products],
+    }
+
+
+def value_fields(model: type[Model], key_fields: tuple[str, ...]) -> list[str]:
+    return [
+        model_field.attname for model_field in model._meta.concrete_fields
+        if not model_field.primary_key and model_field.attname not in key_fields
+    ]
+
+
+def add_rollups(model: type[Model], key_fields: tuple[str, ...], rows: list[Model]) -> None:
+    """
+    Прибавляет rows к строкам с тем же ключом, недостающие создаёт
+    """
+    if not rows:
+        return
+    fields = value_fields(model, key_fields)
+    existing = {
+        tuple(getattr(obj, name) for name in key_fields): obj
+        for obj in model.objects.filter(day__in={row.day for row in rows})
+    }
+    to_create = []
+    to_update = []
+    for row in rows:
+        obj = existing.get(tuple(getattr(row, name) for name in key_fields))
+        if obj is None:
+            to_create.append(row)
+            continue
+        for name in fields:
+            setattr(obj, name, getattr(obj, name) + getattr(row, name))
+        to_update.append(obj)
+    model.objects.bulk_create(to_create, batch_size=ROLLUP_BATCH_SIZE)
+    model.objects.bulk_update(to_update, fields, batch_size=ROLLUP_BATCH_SIZE)
+
+
+def recompute_days(days: set[date], until: datetime) -> None:
+    """
+    Полный пересчёт итогов дней days по заказам, созданным не позже until
+    """
+    if not days:
+        return
+    for model, __ in ROLLUPS:
+        model.objects.filter(day__in=days).delete()
+    rollups = orders_rollups(Order.objects.filter(created_at__date__in=days, created_at__lte=until))
+    for model, rows in rollups.items():
+        model.objects.bulk_create(rows, batch_size=ROLLUP_BATCH_SIZE)
+
+
+def changed_days(state: SalesRollupState) -> set[date]:
+    days = set(SalesRollupDirtyDay.objects.values_list('day', flat=True))
+    if state.watermark is not None and state.changes_since is not None:
+        days.update(
+            Order.objects
+            .filter(created_at__lte=state.watermark, updated_at__gt=state.changes_since)
+            .order_by()
+            .values_list(TruncDate('created_at'), flat=True)
+            .distinct()
+        )
+    return days
+
+
+def run_rollup(lag: timedelta = ROLLUP_LAG) -> RollupResult:
+    """
+    Учитывает новые заказы и пересчитывает изменённые дни
+    """
+    with transaction.atomic():
+        state, __ = SalesRollupState.objects.select_for_update().get_or_create(pk=1)
+        started = timezone.now()
+        cutoff = started - lag
+        if state.watermark is not None:
+            cutoff = max(cutoff, state.watermark)
+
+        days = changed_days(state)
+        new_orders = Order.objects.filter(created_at__lte=cutoff)
+        if state.watermark is not None:
+            new_orders = new_orders.filter(created_at__gt=state.watermark)
+        result = RollupResult(orders=new_orders.count(), watermark=cutoff)
+        if result.orders:
+            rollups = orders_rollups(new_orders)
+            for model, key_fields in ROLLUPS:
+                add_rollups(model, key_fields, rollups[model])
+
+        recompute_days(days, until=cutoff)
+        SalesRollupDirtyDay.objects.filter(day__in=days).delete()
+        result.recomputed_days = sorted(days)
+
+        state.watermark = cutoff
+        # изменения из транзакций, ещё не зафиксированных к started,
+        # имеют updated_at раньше started, поэтому граница отстаёт на тот же lag
+        state.changes_since = started - lag
+        state.save()
+    return result
+
+
+def reset_rollups() -> None:
+    """
+    Удаляет все итоги, следующий run_rollup обработает всю историю
+    """
+    with transaction.atomic():
+        for model, __ in ROLLUPS:
+            model.objects.all().delete()
+        SalesRollupDirtyDay.objects.all().delete()
+        SalesRollupState.objects.all().delete()
+
+
+def mark_day_dirty(day: date) -> None:
+    SalesRollupDirtyDay.objects.bulk_create([SalesRollupDirtyDay(day=day)], ignore_conflicts=True)
+
+
+def rollup_sales_summary(date_from: date | None = None, date_to: date | None = None,
+                         top: int = TOP_PRODUCTS) -> dict:
+    """
+    Сводка в формате shopapp.analytics.sales_summary по таблицам итогов
+    """
+    days = DailySales.objects.all()
+    products = DailyProductSales.objects.order_by()
+    if date_from is not None:
+        days = days.filter(day__gte=date_from)
+        products = products.filter(day__gte=date_from)
+    if date_to is not None:
+        days = days.filter(day__lte=date_to)
+        products = products.filter(day__lte=date_to)
+    days = list(days.values_list('day', 'orders', 'items', 'revenue'))
+    top_products = list(
+        products
+        .values('product_id')
+        .annotate(total_quantity=Sum('quantity'), total_revenue=Sum('revenue'))
+        .order_by('-total_revenue', 'product_id')
+        .values_list('product_id', 'total_quantity', 'total_revenue')[:top]
+    )
+    names = dict(
+        Product.objects.filter(pk__in=[row[0] for row in top_products]).values_list('pk', 'name')
+    ) if top_products else {}
+
+    orders = sum(row[1] for row in days)
+    items = sum(row[2] for row in days)
+    cents = sum(row[3] for row in days) * 100
+    orders_count = orders or 1
+    return {
+        'orders': orders,
+        'items': items,
+        'revenue': money(cents),
+        'average_basket_size': round(items / orders_count, 2),
+        'average_basket_value': money(cents / orders_count),
+        'revenue_by_day': [
+            {'day': day.isoformat(), 'orders': count, 'revenue': money(revenue * 100)}
+            for day, count, __, revenue in days
+        ],
+        'top_products': [
+            {'pk': product_id, 'name': names.get(product_id), 'quantity': quantity, 'revenue': money(revenue * 100)}
+            for product_id, quantity, revenue in top_products
+        ],
+    }
@@ -0,0 +1,8 @@
+"""
+FTS5 индекс товаров, общий код поиска лежит в mysite.fts
+"""
+from mysite.fts import FTSIndex
+
+from .models import Product
+
+PRODUCTS_INDEX = FTSIndex(Product, ['name', 'description'], weights=[10.0, 1.0])
@@ -1,9 +1,52 @@
+from collections import defaultdict
+from functools import partial
+from typing import Callable
+
+from django.db.models import ManyToManyField
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
+from .analytics import TOP_PRODUCTS
 from .models import Product, Order
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Для пакетной записи связанные объекты берутся из context['preloaded'][model],
+    загруженного одним запросом на весь пакет, а не запросом на каждый элемент
+    """
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get('preloaded', {}).get(self.get_queryset().model)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    ModelSerializer, которому можно передать fields и exclude,
+    чтобы оставить только часть полей
+    """
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+        for field_name in exclude or ():
+            self.fields.pop(field_name, None)
+
+
+class ProductSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Product
         fields = (
@@ -19,7 +62,7 @@ class ProductSerializer(serializers.ModelSerializer):
         )
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Order
         fields = (
@@ -30,4 +73,116 @@ class OrderSerializer(serializers.ModelSerializer):
             'created_at',
             'products',
             'receipt',
+            'total',
+            'items_count',
         )
+
+
+class SalesAnalyticsQuerySerializer(serializers.Serializer):
+    """
+    Параметры запроса аналитики продаж
+    """
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    top = serializers.IntegerField(min_value=1, max_value=100, default=TOP_PRODUCTS)
+    # rollup - по таблицам дневных итогов, данные до SalesRollupState.watermark
+    source = serializers.ChoiceField(choices=['live', 'rollup'], default='live')
+
+
+class ValuesRowSerializer:
+    """
+    Быстрое чтение для list и retrieve: представление строится из строк
+    QuerySet.values() с заранее подобранными преобразователями полей
+    ModelSerializer, без создания экземпляров модели.
+    Результат совпадает с serializer.data исходного сериализатора
+    """
+    # значения этих полей приходят из базы уже в нужном виде
+    identity_fields = (
+        serializers.CharField,
+        serializers.IntegerField,
+        serializers.BooleanField,
+        serializers.PrimaryKeyRelatedField,
+    )
+
+    def __init__(self, serializer: serializers.ModelSerializer):
+        self.model = serializer.Meta.model
+        self.request = serializer.context.get('request')
+        self.columns: list[str] = []
+        self.converters: list[tuple[str, str, Callable | None]] = []
+        self.many_to_many: list[tuple[str, ManyToManyField]] = []
+
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.ManyRelatedField):
+                # значение кладёт в строку load_many_to_many
+                self.many_to_many.append((field.field_name, self.model._meta.get_field(field.source)))
+                self.converters.append((field.field_name, field.field_name, None))
+                continue
+            column = self.get_column(field.source)
+            self.columns.append(column)
+            self.converters.append((field.field_name, column, self.get_converter(field)))
+        if 'pk' not in self.columns:
+            self.columns.append('pk')
+
+    def get_column(self, source: str) -> str:
+        if source == 'pk':
+            return source
+        return self.model._meta.get_field(source).attname
+
+    def get_converter(self, field: serializers.Field) -> Callable | None:
+        if isinstance(field, self.identity_fields):
+            return None
+        if isinstance(field, serializers.FileField):
+            model_field = self.model._meta.get_field(field.source)
+            return partial(self.file_url, model_field.storage, field)
+        return field.to_representation
+
+    def file_url(self, storage, field: serializers.FileField, name: str):
+        if not name:
+            return None
+        if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return name
+        url = storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+    def load_many_to_many(self, rows: list[dict]) -> None:
+        """
+        id связанных объектов для всех строк: один запрос на каждое M2M поле
+        """
+        pks = [row['pk'] for row in rows]
+        for field_name, model_field in self.many_to_many:
+            through = model_field.remote_field.through
+            source_name = model_field.m2m_field_name()
+            target_name = model_field.m2m_reverse_field_name()
+            ordering = [
+                f'{target_name}__{name}'
+                for name in model_field.related_model._meta.ordering
+            ]
+            links = (
+                through.objects
+                .filter(**{f'{source_name}__in': pks})
+                .order_by(*ordering, f'{target_name}_id')
+                .values_list(f'{source_name}_id', f'{target_name}_id')
+            )
+            related = defaultdict(list)
+            for pk, related_pk in links:
+                related[pk].append(related_pk)
+            for row in rows:
+                row[field_name] = related[row['pk']]
+
+    def to_representation(self, row: dict) -> dict:
+        data = {}
+        for field_name, column, converter in self.converters:
+            value = row[column]
+            if converter is not None and value is not None:
+                value = converter(value)
+            data[field_name] = value
+        return data
+
+    def serialize(self, rows: list[dict]) -> list[dict]:
+        if self.many_to_many and rows:
+            self.load_many_to_many(rows)
+        return [self.to_representation(row) for row in rows]
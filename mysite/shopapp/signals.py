@@ -0,0 +1,117 @@
+from collections import Counter
+
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed, post_migrate
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .facets import apply_facet_deltas, facet_deltas, facet_keys, PRODUCT_FACET_FIELDS
+from .models import Product, Order, ProductImage
+from .order_totals import apply_price_change, recompute_order_totals
+from .rollups import mark_day_dirty
+from .search import PRODUCTS_INDEX
+from .versioning import bump_versions_on_commit, user_orders_version, PRODUCTS_VERSION
+
+
+def orders_users_versions(order_ids) -> list[str]:
+    users_ids = Order.objects.filter(pk__in=order_ids).values_list('user_id', flat=True).distinct()
+    return [user_orders_version(user_id) for user_id in users_ids]
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, **kwargs):
+    bump_versions_on_commit([PRODUCTS_VERSION])
+
+
+def facet_fields_saved(update_fields) -> bool:
+    return update_fields is None or bool(set(update_fields) & set(PRODUCT_FACET_FIELDS))
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance: Product, update_fields=None, **kwargs):
+    instance._old_facet_values = None
+    if instance.pk is not None and facet_fields_saved(update_fields):
+        instance._old_facet_values = Product.objects.filter(pk=instance.pk).values(*PRODUCT_FACET_FIELDS).first()
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance: Product, created: bool, update_fields=None, **kwargs):
+    if not created and not facet_fields_saved(update_fields):
+        return
+    deltas = facet_deltas([instance])
+    old_values = getattr(instance, '_old_facet_values', None)
+    if old_values is not None:
+        deltas.subtract(facet_keys(old_values))
+        # price входит в поля фасетов, старая цена уже прочитана
+        price = Product._meta.get_field('price').to_python(instance.price)
+        apply_price_change(instance.pk, price - old_values['price'])
+    apply_facet_deltas(deltas)
+
+
+@receiver(pre_delete, sender=Product)
+def product_deleting(sender, instance: Product, **kwargs):
+    # связи с заказами удаляются каскадом без m2m_changed
+    instance._orders_ids = list(instance.orders.values_list('pk', flat=True))
+    instance._orders_versions = orders_users_versions(instance._orders_ids)
+    # экземпляр мог устареть после queryset.update, счётчики снимаются по значениям из базы
+    instance._old_facet_values = Product.objects.filter(pk=instance.pk).values(*PRODUCT_FACET_FIELDS).first()
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance: Product, **kwargs):
+    old_values = getattr(instance, '_old_facet_values', None)
+    if old_values is not None:
+        apply_facet_deltas(Counter({key: -1 for key in facet_keys(old_values)}))
+    recompute_order_totals(getattr(instance, '_orders_ids', ()))
+    bump_versions_on_commit(getattr(instance, '_orders_versions', ()))
+
+
+@receiver(pre_save, sender=Order)
+def order_saving(sender, instance: Order, update_fields=None, **kwargs):
+    # заказ может перейти к другому пользователю, сбрасываются выгрузки обоих
+    instance._old_user_id = None
+    if instance.pk is not None and (update_fields is None or 'user' in update_fields):
+        instance._old_user_id = Order.objects.filter(pk=instance.pk).values_list('user_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Order)
+def order_changed(sender, instance: Order, **kwargs):
+    users_ids = {instance.user_id, getattr(instance, '_old_user_id', None)} - {None}
+    bump_versions_on_commit(user_orders_version(user_id) for user_id in users_ids)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_changed(sender, instance: ProductImage, **kwargs):
+    # updated_at товара - версия его фрагментов в кэше и ETag
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance: Order, **kwargs):
+    # удалённый заказ не найти по updated_at, его день пересчитывается целиком
+    mark_day_dirty(timezone.localdate(instance.created_at))
+
+
+@receiver(m2m_changed, sender=Order.products.through)
+def order_products_changed(sender, instance, action: str, reverse: bool, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            recompute_order_totals([instance.pk])
+            bump_versions_on_commit([user_orders_version(instance.user_id)])
+        return
+
+    # instance - товар, pk_set - id заказов
+    if action == 'pre_clear':
+        instance._orders_ids = list(instance.orders.values_list('pk', flat=True))
+        instance._orders_versions = orders_users_versions(instance._orders_ids)
+    elif action == 'post_clear':
+        recompute_order_totals(getattr(instance, '_orders_ids', ()))
+        bump_versions_on_commit(getattr(instance, '_orders_versions', ()))
+    elif action in ('post_add', 'post_remove'):
+        recompute_order_totals(pk_set)
+        bump_versions_on_commit(orders_users_versions(pk_set))
+
+
+@receiver(post_migrate)
+def ensure_search_index(sender, using, **kwargs):
+    if sender.name == 'shopapp':
+        PRODUCTS_INDEX.ensure(using)
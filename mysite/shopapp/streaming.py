@@ -0,0 +1,98 @@
+"""
+Помощники для потоковой выдачи больших ответов (StreamingHttpResponse).
+
+Под ASGI Django 4.2 читает синхронный streaming_content целиком
+(sync_to_async(list)) и только потом отправляет, поэтому там поток
+оборачивается в асинхронный итератор (см. stream_parts).
+"""
+import csv
+import zlib
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpRequest
+
+from .fast_json import dumps
+
+EXPORT_CHUNK_SIZE = 2000
+# StreamingHttpResponse принимает асинхронные итераторы начиная с Django 4.2
+ASYNC_STREAMING = django.VERSION >= (4, 2)
+
+
+class Echo:
+    """
+    Псевдо-буфер для csv.writer: write возвращает строку, а не пишет её
+    """
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def iter_csv_lines(header: Iterable[str], rows: Iterable[Iterable]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_json_list(key: str, items: Iterable) -> Iterator[str]:
+    """
+    Отдаёт {"key":[...]} по частям, в компактном формате dumps
+    """
+    yield dumps(key).join(['{', ':['])
+    for i, item in enumerate(items):
+        yield (',' if i else '') + dumps(item)
+    yield ']}'
+
+
+def iter_ndjson(items: Iterable) -> Iterator[str]:
+    for item in items:
+        yield dumps(item) + '\n'
+
+
+def iter_joined(parts: Iterable[str], size: int) -> Iterator[str]:
+    """
+    Склеивает мелкие части по size штук, чтобы не отдавать ответ построчно
+    """
+    iterator = iter(parts)
+    while chunk := ''.join(islice(iterator, size)):
+        yield chunk
+
+
+def iter_gzip(parts: Iterable[str], encoding: str = 'utf-8') -> Iterator[bytes]:
+    """
+    Сжимает поток в формат gzip на лету
+    """
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for part in parts:
+        data = compressor.compress(part.encode(encoding))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def aiter_sync(parts: Iterable, size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator:
+    """
+    Асинхронный итератор поверх синхронного потока частей (с запросами к базе внутри).
+    Части забираются пачками по size за один переход в поток sync_to_async
+    """
+    iterator = iter(parts)
+    next_batch = sync_to_async(lambda: list(islice(iterator, size)))
+    while batch := await next_batch():
+        for part in batch:
+            yield part
+
+
+def stream_parts(request: HttpRequest, parts: Iterable) -> Iterable | AsyncIterator:
+    """
+    Содержимое StreamingHttpResponse из синхронного представления:
+    под ASGI асинхронный итератор, под WSGI исходный поток
+    """
+    # DRF Request хранит исходный запрос Django в _request
+    request = getattr(request, '_request', request)
+    if ASYNC_STREAMING and isinstance(request, ASGIRequest):
+        return aiter_sync(parts)
+    return parts
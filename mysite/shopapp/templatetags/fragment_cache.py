@@ -0,0 +1,160 @@
+"""
+Кэш фрагментов шаблонов с версией объекта.
+
+    {% load fragment_cache %}
+    {% cachedfor 'product_card' product in products version product.updated_at %}
+        ...
+    {% endcachedfor %}
+
+Ключ фрагмента включает имя, язык, pk объекта и значения после version
+(updated_at, счётчики версий и т.п.). Изменённый объект получает новый ключ,
+старые ключи перестают читаться и вытесняются по таймауту.
+Ключи всех элементов цикла читаются одним cache.get_many, заново рендерятся
+только отсутствующие фрагменты, они сохраняются одним cache.set_many.
+forloop внутри cachedfor недоступен.
+
+    {% cachedfor 'order_row' order in orders version order.updated_at prefetch 'products' %}
+
+Связи после prefetch загружаются prefetch_related_objects только
+для элементов, чьих фрагментов нет в кэше.
+
+    {% cachedobject 'product_details' product version product.updated_at prefetch 'images' %}
+        ...
+    {% endcachedobject %}
+
+То же для одного объекта, связи после prefetch загружаются только при промахе.
+"""
+import hashlib
+
+from django import template
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects
+from django.utils import translation
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+FRAGMENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def fragment_key(name: str, pk, versions: list) -> str:
+    parts = [name, translation.get_language() or '', str(pk), *(str(version) for version in versions)]
+    digest = hashlib.md5(':'.join(parts).encode(), usedforsecurity=False).hexdigest()
+    return f'shopapp_fragment:{name}:{digest}'
+
+
+def split_prefetch(parser, bits: list[str]) -> tuple[list[str], list]:
+    if 'prefetch' not in bits:
+        return bits, []
+    index = bits.index('prefetch')
+    if index == len(bits) - 1:
+        raise template.TemplateSyntaxError("Expected one or more lookups after 'prefetch'")
+    return bits[:index], [parser.compile_filter(bit) for bit in bits[index + 1:]]
+
+
+def parse_versions(parser, bits: list[str]) -> list:
+    if not bits:
+        return []
+    if bits[0] != 'version' or len(bits) < 2:
+        raise template.TemplateSyntaxError("Expected 'version' followed by one or more values")
+    return [parser.compile_filter(bit) for bit in bits[1:]]
+
+
+class CachedForNode(template.Node):
+    def __init__(self, name, var_name: str, sequence, versions: list, nodelist, prefetch: list | None = None):
+        self.name = name
+        self.var_name = var_name
+        self.sequence = sequence
+        self.versions = versions
+        self.nodelist = nodelist
+        self.prefetch = prefetch or []
+
+    def item_key(self, name: str, item, context) -> str:
+        with context.push({self.var_name: item}):
+            versions = [version.resolve(context) for version in self.versions]
+        return fragment_key(name, item.pk, versions)
+
+    def render(self, context) -> str:
+        name = self.name.resolve(context)
+        items = list(self.sequence.resolve(context, ignore_failures=True) or [])
+        keys = [self.item_key(name, item, context) for item in items]
+        cached = cache.get_many(keys)
+        missed = [item for item, key in zip(items, keys) if key not in cached]
+        if missed and self.prefetch:
+            prefetch_related_objects(missed, *(lookup.resolve(context) for lookup in self.prefetch))
+        rendered = {}
+        parts = []
+        for item, key in zip(items, keys):
+            if key not in cached:
+                with context.push({self.var_name: item}):
+                    rendered[key] = self.nodelist.render(context)
+            parts.append(rendered.get(key, cached.get(key)))
+        if rendered:
+            cache.set_many(rendered, FRAGMENT_CACHE_TIMEOUT)
+        return mark_safe(''.join(parts))
+
+
+class CachedObjectNode(template.Node):
+    def __init__(self, name, obj, versions: list, nodelist, prefetch: list | None = None):
+        self.name = name
+        self.obj = obj
+        self.versions = versions
+        self.nodelist = nodelist
+        self.prefetch = prefetch or []
+
+    def render(self, context) -> str:
+        obj = self.obj.resolve(context)
+        versions = [version.resolve(context) for version in self.versions]
+        key = fragment_key(self.name.resolve(context), obj.pk, versions)
+        content = cache.get(key)
+        if content is None:
+            if self.prefetch:
+                prefetch_related_objects([obj], *(lookup.resolve(context) for lookup in self.prefetch))
+            content = self.nodelist.render(context)
+            cache.set(key, content, FRAGMENT_CACHE_TIMEOUT)
+        return mark_safe(content)
+
+
+@register.tag
+def cachedfor(parser, token):
+    """
+    {% cachedfor name item in items version value [value ...] [prefetch lookup ...] %}...{% endcachedfor %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 5 or bits[3] != 'in':
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' expects: name item in items [version value ...] [prefetch lookup ...]"
+        )
+    version_bits, prefetch = split_prefetch(parser, bits[5:])
+    nodelist = parser.parse(('endcachedfor',))
+    parser.delete_first_token()
+    return CachedForNode(
+        parser.compile_filter(bits[1]),
+        bits[2],
+        parser.compile_filter(bits[4]),
+        parse_versions(parser, version_bits),
+        nodelist,
+        prefetch,
+    )
+
+
+@register.tag
+def cachedobject(parser, token):
+    """
+    {% cachedobject name object version value [value ...] [prefetch lookup ...] %}...{% endcachedobject %}
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{bits[0]}' expects: name object [version value ...] [prefetch lookup ...]"
+        )
+    version_bits, prefetch = split_prefetch(parser, bits[3:])
+    nodelist = parser.parse(('endcachedobject',))
+    parser.delete_first_token()
+    return CachedObjectNode(
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]),
+        parse_versions(parser, version_bits),
+        nodelist,
+        prefetch,
+    )
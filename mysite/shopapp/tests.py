@@ -1,13 +1,59 @@
+import gzip
+import json
+import re
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO
+from importlib import import_module
 from string import ascii_letters
 from random import choices
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+from unittest import mock, skipIf
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
+
+from django.apps import apps as django_apps
 from django.contrib.auth.models import User, Permission, Group
-from django.test import TestCase
+from django.core.handlers.asgi import ASGIHandler
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.forms import FileField
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone as django_timezone, translation
+from django.utils.translation import gettext_lazy
 
 from mysite import settings
-from shopapp.models import Product, Order
+from shopapp.common import stream_csv_products, save_csv_products, save_csv_orders, upsert_csv_products
+from shopapp.parallel_import import parallel_import_products, split_file
+from shopapp.admin import mark_archived
+from shopapp.jobs import STALE_JOB_TIMEOUT, claim_pending_jobs, fail_stale_jobs, report_progress, run_import_job
+from shopapp.models import (Product, ProductFacetCount, Order, ImportJob, DailySales, DailyProductSales,
+                            DailyUserSales)
 from shopapp.utils import add_to_numbers
+from shopapp.serializers import ProductSerializer, OrderSerializer
+from shopapp.search import PRODUCTS_INDEX
+from shopapp.facets import facet_counts, stored_facet_counts
+from shopapp.order_totals import recompute_all_order_totals
+from shopapp import analytics
+from shopapp.rollups import run_rollup
+from shopapp.templatetags.fragment_cache import fragment_key
+from shopapp import fast_json
+from shopapp.fast_json import FastJSONRenderer, FastJsonResponse, dumps, dumps_bytes
+from shopapp.views import OrdersDataExportView, OrderViewSet, ProductsDataExportView
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shopapp-tests',
+    },
+}
 
 
 class AddTwoNumbersTestCase(TestCase):
@@ -110,7 +156,7 @@ class ProductsExportViewTestCase(TestCase):
             }
             for product in products
         ]
-        products_data = response.json()
+        products_data = json.loads(b''.join(response))
         self.assertEqual(
             products_data['products'],
             expected_data
@@ -203,8 +249,1416 @@ class OrdersExportViewTestCase(TestCase):
             }
             for order in orders
         ]
-        orders_data = response.json()
+        orders_data = json.loads(b''.join(response))
         self.assertEqual(
             orders_data['orders'],
             expected_data
         )
+
+
+class SaveCSVProductsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='csv-user', password='12345')
+
+    def make_csv(self, rows_count: int, user_id: int) -> BytesIO:
+        lines = ['name,description,price,discount,created_by']
+        lines.extend(
+            f'Product {i},Description {i},{i}.50,{i % 10},{user_id}'
+            for i in range(rows_count)
+        )
+        return BytesIO('\n'.join(lines).encode('utf-8'))
+
+    def test_stream_csv_products_in_batches(self):
+        file = self.make_csv(25, self.user.pk)
+        # savepoint pair, one user lookup for the first batch, one insert and one facet counts update per batch
+        with self.assertNumQueries(2 + 1 + 3 * 2):
+            created = stream_csv_products(file, encoding='utf-8', batch_size=10)
+        self.assertEqual(created, 25)
+        self.assertEqual(Product.objects.filter(created_by=self.user).count(), 25)
+
+    def test_save_csv_products_returns_products(self):
+        products = save_csv_products(self.make_csv(3, self.user.pk), encoding='utf-8')
+        self.assertEqual([p.name for p in products], ['Product 0', 'Product 1', 'Product 2'])
+
+    def test_unknown_user(self):
+        with self.assertRaises(User.DoesNotExist):
+            stream_csv_products(self.make_csv(3, self.user.pk + 100), encoding='utf-8')
+
+    def test_unknown_user_in_later_batch_rolls_back(self):
+        content = self.make_csv(20, self.user.pk).getvalue() + f'\nLate,,1,0,{self.user.pk + 100}'.encode()
+        with self.assertRaises(User.DoesNotExist):
+            stream_csv_products(BytesIO(content), encoding='utf-8', batch_size=10)
+        self.assertFalse(Product.objects.exists())
+
+
+class SaveCSVOrdersTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='csv-user', password='12345')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', created_by=self.user)
+            for i in range(3)
+        ]
+
+    def test_import_orders(self):
+        p1, p2, p3 = (p.pk for p in self.products)
+        content = '\n'.join([
+            'delivery_address,promocode,user,products',
+            f'Address 1,PROMO,{self.user.pk},"{p1},{p2}"',
+            f'Address 2,,{self.user.pk},"{p3}"',
+            f'Address 3,,{self.user.pk + 100},"{p1}"',
+            f'Address 4,,{self.user.pk},"{p1},{p3 + 100}"',
+            f'Address 5,,abc,"{p1}"',
+        ])
+        # user ids, product ids, orders insert, through insert, order totals + savepoint
+        with self.assertNumQueries(5 + 2):
+            result = save_csv_orders(BytesIO(content.encode('utf-8')), encoding='utf-8')
+
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line for line, reason in result.rejected], [4, 5, 6])
+        order = Order.objects.get(delivery_address='Address 1')
+        self.assertEqual(order.promocode, 'PROMO')
+        self.assertEqual(sorted(order.products.values_list('pk', flat=True)), [p1, p2])
+
+
+class ImportJobTestCase(TestCase):
+    def setUp(self) -> None:
+        self.media_dir = TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_dir.name)
+        self.settings_override.enable()
+        # admin urls live under i18n_patterns, LANGUAGE_CODE itself is not in LANGUAGES
+        translation.activate('en')
+        self.user = User.objects.create_superuser(username='admin-user', password='12345')
+        self.client.force_login(self.user)
+
+    def tearDown(self) -> None:
+        translation.deactivate()
+        self.settings_override.disable()
+        self.media_dir.cleanup()
+
+    def test_admin_import_requires_staff(self):
+        content = b'name,description,price,discount,created_by\n'
+        self.client.logout()
+        for name in ('admin:import_products_csv', 'admin:import_orders_csv'):
+            response = self.client.post(reverse(name), {'csv_file': SimpleUploadedFile('data.csv', content)})
+            self.assertEqual(response.status_code, 302)
+            self.assertIn(reverse('admin:login'), response.url)
+
+        staff = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post(
+            reverse('admin:import_products_csv'), {'csv_file': SimpleUploadedFile('data.csv', content)},
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_admin_import_enqueues_job(self):
+        content = f'name,description,price,discount,created_by\nTable,Wooden,10.00,0,{self.user.pk}\n'
+        response = self.client.post(
+            reverse('admin:import_products_csv'),
+            {'csv_file': SimpleUploadedFile('products.csv', content.encode('utf-8'))},
+        )
+        job = ImportJob.objects.get()
+        self.assertRedirects(response, reverse('admin:shopapp_importjob_status', kwargs={'pk': job.pk}))
+        self.assertEqual(job.status, ImportJob.Status.PENDING)
+        self.assertFalse(Product.objects.exists())
+
+        self.assertEqual(claim_pending_jobs(limit=4), [job.pk])
+        self.assertEqual(claim_pending_jobs(limit=4), [])
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual(job.rows_processed, 1)
+        self.assertTrue(Product.objects.filter(name='Table', created_by=self.user).exists())
+
+        response = self.client.get(reverse('admin:shopapp_importjob_status', kwargs={'pk': job.pk}))
+        self.assertContains(response, 'Rows processed: 1')
+
+    def test_orders_job_reports_rejected_rows(self):
+        product = Product.objects.create(name='Table', created_by=self.user)
+        content = '\n'.join([
+            'delivery_address,promocode,user,products',
+            f'Address 1,,{self.user.pk},"{product.pk}"',
+            f'Address 2,,{self.user.pk},"{product.pk + 100}"',
+        ])
+        job = ImportJob.objects.create(
+            kind=ImportJob.Kind.ORDERS,
+            file=SimpleUploadedFile('orders.csv', content.encode('utf-8')),
+        )
+        claim_pending_jobs(limit=1)
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.DONE)
+        self.assertEqual((job.rows_processed, job.rows_rejected), (2, 1))
+        self.assertIn('Line 3', job.errors)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_stale_running_jobs_are_failed(self):
+        jobs = [
+            ImportJob.objects.create(kind=ImportJob.Kind.PRODUCTS, file=SimpleUploadedFile('p.csv', b''))
+            for __ in range(3)
+        ]
+        self.assertEqual(len(claim_pending_jobs(limit=3)), 3)
+        # the first worker died long ago, the second keeps reporting, the third is ours
+        long_ago = django_timezone.now() - STALE_JOB_TIMEOUT * 2
+        ImportJob.objects.filter(pk__in=[jobs[0].pk, jobs[2].pk]).update(heartbeat_at=long_ago)
+        ImportJob.objects.filter(pk=jobs[1].pk).update(started_at=long_ago, heartbeat_at=long_ago)
+        report_progress(jobs[1].pk, 10)
+
+        self.assertEqual(fail_stale_jobs(exclude=[jobs[2].pk]), 1)
+        statuses = [ImportJob.objects.get(pk=job.pk).status for job in jobs]
+        self.assertEqual(statuses, [ImportJob.Status.FAILED, ImportJob.Status.RUNNING, ImportJob.Status.RUNNING])
+        self.assertIn('stopped responding', ImportJob.objects.get(pk=jobs[0].pk).errors)
+        self.assertEqual(fail_stale_jobs(), 1)
+
+
+class ParallelImportProductsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='csv-user', password='12345')
+        self.file = NamedTemporaryFile('w', suffix='.csv', encoding='utf-8')
+        self.file.write('name,description,price,discount,created_by\n')
+        for i in range(50):
+            self.file.write(f'Product {i},"Desc, {i}",{i}.5,{i % 10},{self.user.pk}\n')
+        self.file.write(f'Bad price,,abc,0,{self.user.pk}\n')
+        self.file.write(f'Unknown user,,1,0,{self.user.pk + 100}\n')
+        self.file.flush()
+
+    def tearDown(self) -> None:
+        self.file.close()
+
+    def test_split_file_aligned_to_lines(self):
+        with open(self.file.name, 'rb') as file:
+            content = file.read()
+        header_end = content.index(b'\n') + 1
+        with mock.patch('shopapp.parallel_import.MIN_CHUNK_SIZE', 100):
+            ranges = split_file(self.file.name, header_end, chunks=8)
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[0][0], header_end)
+        self.assertEqual(ranges[-1][1], len(content))
+        for start, end in ranges:
+            self.assertEqual(content[end - 1:end], b'\n')
+
+    def test_split_file_caps_chunk_size(self):
+        with mock.patch('shopapp.parallel_import.MIN_CHUNK_SIZE', 100), \
+                mock.patch('shopapp.parallel_import.MAX_CHUNK_SIZE', 200):
+            ranges = split_file(self.file.name, 0, chunks=2)
+        self.assertGreater(len(ranges), 2)
+        # a range ends at the first line break after the cap
+        self.assertTrue(all(end - start < 300 for start, end in ranges))
+
+    def test_import(self):
+        for workers in (1, 2):
+            Product.objects.all().delete()
+            with mock.patch('shopapp.parallel_import.MIN_CHUNK_SIZE', 100), \
+                    mock.patch('shopapp.parallel_import.MAX_CHUNK_SIZE', 100):
+                result = parallel_import_products(self.file.name, workers=workers, batch_size=20)
+            self.assertEqual(result.created, 50)
+            self.assertEqual([line for line, reason in result.rejected], [52, 53])
+            product = Product.objects.get(name='Product 7')
+            self.assertEqual((str(product.price), product.discount, product.description), ('7.50', 7, 'Desc, 7'))
+
+
+class UpsertCSVProductsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='csv-user', password='12345')
+
+    def upsert(self, lines: list[str], **kwargs):
+        content = '\n'.join(['name,description,price,discount,created_by,sku', *lines])
+        return upsert_csv_products(BytesIO(content.encode('utf-8')), encoding='utf-8', **kwargs)
+
+    def test_rerun_is_idempotent(self):
+        lines = [
+            f'Table,Wooden,10.00,0,{self.user.pk},T-1',
+            f'Chair,Soft,5.50,5,{self.user.pk},C-1',
+        ]
+        result = self.upsert(lines)
+        self.assertEqual((result.created, result.updated, result.unchanged), (2, 0, 0))
+
+        # savepoint pair, user lookup + products prefetch, no writes
+        with self.assertNumQueries(2 + 2):
+            result = self.upsert(lines)
+        self.assertEqual((result.created, result.updated, result.unchanged), (0, 0, 2))
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_changed_rows_are_updated(self):
+        self.upsert([f'Table,Wooden,10.00,0,{self.user.pk},T-1'])
+        result = self.upsert([
+            f'Table,Oak,12.00,0,{self.user.pk},T-1',
+            f'Lamp,Bright,3.00,0,{self.user.pk},L-1',
+        ])
+        self.assertEqual((result.created, result.updated, result.unchanged), (1, 1, 0))
+        table = Product.objects.get(name='Table')
+        self.assertEqual((table.description, str(table.price)), ('Oak', '12.00'))
+
+    def test_sku_key(self):
+        self.upsert([f'Table,Wooden,10.00,0,{self.user.pk},T-1'], key=['sku'])
+        result = self.upsert([f'Big table,Wooden,10.00,0,{self.user.pk},T-1'], key=['sku'])
+        self.assertEqual(result.updated, 1)
+        self.assertEqual(Product.objects.get(sku='T-1').name, 'Big table')
+
+    def test_duplicate_key_in_file_rejects_earlier_row(self):
+        result = self.upsert([
+            f'Table,Wooden,10.00,0,{self.user.pk},T-1',
+            f'Chair,Soft,5.50,5,{self.user.pk},C-1',
+            f'Table,Oak,12.00,0,{self.user.pk},T-2',
+        ])
+        self.assertEqual((result.created, result.updated, result.unchanged), (2, 0, 0))
+        self.assertEqual(result.rejected, [(2, 'duplicate key in file')])
+        self.assertEqual(result.processed, 3)
+        self.assertEqual(Product.objects.get(name='Table').description, 'Oak')
+
+
+class ProductsDownloadCSVTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        Product.objects.create(name='Table', description='Wooden, big', price='10.50', created_by=self.user)
+        Product.objects.create(name='Chair', price='5', discount=10, archived=True, created_by=self.user)
+
+    def test_download_csv_is_streamed(self):
+        response = self.client.get(reverse('shopapp:product-download-csv'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response).decode('utf-8')
+        self.assertEqual(
+            content.splitlines(),
+            [
+                'name,description,price,discount,archived',
+                'Chair,,5.00,10,True',
+                'Table,"Wooden, big",10.50,0,False',
+            ],
+        )
+
+    def test_download_csv_filtered(self):
+        response = self.client.get(reverse('shopapp:product-download-csv'), {'archived': 'false'})
+        content = b''.join(response).decode('utf-8')
+        self.assertEqual(len(content.splitlines()), 2)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductsExportSnapshotTestCase(TestCase):
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='testpassword')
+        self.product = Product.objects.create(name='Table', price='10.50', created_by=self.user)
+
+    def get_export(self, **headers):
+        response = self.client.get(reverse('shopapp:products_export'), **headers)
+        if response.status_code != 200:
+            return response, None
+        return response, json.loads(b''.join(response))
+
+    def test_snapshot_is_cached_and_invalidated(self):
+        with self.assertNumQueries(1):
+            response, data = self.get_export()
+        self.assertTrue(response.streaming)
+        self.assertEqual(data['products'], [{
+            'pk': self.product.pk,
+            'name': 'Table',
+            'price': '10.50',
+            'archived': False,
+            'created_by': self.user.pk,
+        }])
+
+        with self.assertNumQueries(0):
+            cached_response, cached_data = self.get_export()
+        self.assertEqual(cached_data, data)
+
+        self.product.name = 'Big table'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        response, data = self.get_export()
+        self.assertEqual(data['products'][0]['name'], 'Big table')
+
+    def test_large_snapshot_is_not_cached(self):
+        with mock.patch.object(ProductsDataExportView, 'snapshot_max_size', 10):
+            response, data = self.get_export()
+            self.assertEqual(data['products'][0]['name'], 'Table')
+            with self.assertNumQueries(1):
+                self.get_export()
+
+    def test_not_modified(self):
+        response, __ = self.get_export()
+        etag = response['ETag']
+        response, __ = self.get_export(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name='Chair', created_by=self.user)
+        response, data = self.get_export(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['products']), 2)
+
+
+class OrdersExportStreamingTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.client.force_login(self.user)
+        self.products = [
+            Product.objects.create(name=name, created_by=self.user)
+            for name in ('B', 'A', 'C')
+        ]
+        self.orders = []
+        for i in range(5):
+            order = Order.objects.create(user=self.user, delivery_address=f'Address {i}')
+            order.products.set(self.products[:i % 3 + 1])
+            self.orders.append(order)
+
+    def expected(self, order: Order) -> dict:
+        return {
+            'id': order.pk,
+            'delivery_address': order.delivery_address,
+            'promocode': order.promocode,
+            'user_id': order.user_id,
+            'products_id': [product.pk for product in order.products.all()],
+        }
+
+    def test_json_in_keyset_batches(self):
+        with mock.patch.object(OrdersDataExportView, 'batch_size', 2):
+            response = self.client.get(reverse('shopapp:orders_export'))
+            self.assertTrue(response.streaming)
+            # 3 batches of 2 queries and the final empty batch, all while the body is consumed
+            with self.assertNumQueries(3 * 2 + 1):
+                content = b''.join(response)
+        self.assertEqual(json.loads(content)['orders'], [self.expected(order) for order in self.orders])
+
+    def test_ndjson_since_id(self):
+        response = self.client.get(
+            reverse('shopapp:orders_export'),
+            {'format': 'ndjson', 'since_id': self.orders[2].pk},
+        )
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [self.expected(order) for order in self.orders[3:]])
+
+    def test_invalid_since_id(self):
+        response = self.client.get(reverse('shopapp:orders_export'), {'since_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class UserOrdersExportCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='buyer', password='12345')
+        self.product = Product.objects.create(name='Table', created_by=self.user)
+        self.order = Order.objects.create(user=self.user, delivery_address='Address')
+        self.url = reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk})
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def get_orders(self) -> list[dict]:
+        return self.client.get(self.url).json()['orders']
+
+    def test_cached_until_orders_change(self):
+        self.assertEqual(self.get_orders()[0]['products_id'], [])
+        with self.assertNumQueries(0):
+            self.get_orders()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.products.add(self.product)
+        self.assertEqual(self.get_orders()[0]['products_id'], [self.product.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.orders.remove(self.order)
+        self.assertEqual(self.get_orders()[0]['products_id'], [])
+
+        self.order.delivery_address = 'New address'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.save()
+        self.assertEqual(self.get_orders()[0]['delivery_address'], 'New address')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Order.objects.create(user=self.user)
+        self.assertEqual(len(self.get_orders()), 2)
+
+    def test_reassigned_order_invalidates_both_users(self):
+        other = User.objects.create_user(username='other', password='12345')
+        other_url = reverse('shopapp:user_orders_export', kwargs={'user_id': other.pk})
+        self.assertEqual(len(self.get_orders()), 1)
+        self.assertEqual(self.client.get(other_url).json()['orders'], [])
+
+        self.order.user = other
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.order.save()
+        # versions are bumped only after the transaction commits
+        self.assertEqual(len(self.get_orders()), 1)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get_orders(), [])
+        self.assertEqual(len(self.client.get(other_url).json()['orders']), 1)
+
+    def test_product_delete_invalidates(self):
+        self.order.products.add(self.product)
+        self.assertEqual(self.get_orders()[0]['products_id'], [self.product.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertEqual(self.get_orders()[0]['products_id'], [])
+
+    def test_miss_has_no_n_plus_one(self):
+        for __ in range(5):
+            Order.objects.create(user=self.user).products.add(self.product)
+        # user, orders batch, products ids, final empty batch
+        with self.assertNumQueries(4):
+            self.assertEqual(len(self.get_orders()), 6)
+
+
+class AdminExportCSVTestCase(TestCase):
+    def setUp(self) -> None:
+        translation.activate('en')
+        self.user = User.objects.create_superuser(username='admin-user', password='12345')
+        self.client.force_login(self.user)
+        self.products = [
+            Product.objects.create(name=f'Product {i}', price=i, created_by=self.user)
+            for i in range(3)
+        ]
+
+    def tearDown(self) -> None:
+        translation.deactivate()
+
+    def export(self, action: str):
+        response = self.client.post(
+            reverse('admin:shopapp_product_changelist'),
+            {'action': action, '_selected_action': [p.pk for p in self.products[:2]]},
+        )
+        self.assertTrue(response.streaming)
+        return b''.join(response)
+
+    def test_export_csv(self):
+        lines = self.export('export_csv').decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:7], ['id', 'name', 'description', 'price', 'discount', 'created_ad', 'created_by_id'])
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split(',')[6], str(self.user.pk))
+
+    def test_export_csv_gzip(self):
+        content = gzip.decompress(self.export('export_csv_gzip')).decode('utf-8')
+        self.assertEqual(content, self.export('export_csv').decode('utf-8'))
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductAdminOrdersInlineTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_superuser(username='admin-user', password='12345')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='Table', price=10, created_by=self.user)
+        self.order = Order.objects.create(user=self.user, delivery_address='Address')
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def form_data(self, response) -> dict:
+        data = {}
+        forms = [response.context['adminform'].form]
+        for inline in response.context['inline_admin_formsets']:
+            forms.append(inline.formset.management_form)
+            forms.extend(inline.formset.forms)
+        for form in forms:
+            for bound_field in form:
+                value = bound_field.value()
+                if value is not None and not isinstance(bound_field.field, FileField):
+                    data[bound_field.html_name] = value
+        return data
+
+    def test_orders_inline_invalidates_user_orders_export(self):
+        export_url = reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk})
+        self.assertEqual(self.client.get(export_url).json()['orders'][0]['products_id'], [])
+
+        change_url = reverse('admin:shopapp_product_change', args=[self.product.pk])
+        response = self.client.get(change_url)
+        data = self.form_data(response)
+        formset = next(
+            inline.formset for inline in response.context['inline_admin_formsets']
+            if inline.formset.model is Order.products.through
+        )
+        data[f'{formset.prefix}-TOTAL_FORMS'] = 1
+        data[f'{formset.prefix}-0-order'] = self.order.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(change_url, data)
+        self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(self.client.get(export_url).json()['orders'][0]['products_id'], [self.product.pk])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        # одинаковые цены проверяют разрешение равенства по pk
+        for i in range(25):
+            Product.objects.create(name=f'Product {i:02}', price=i % 4, created_by=self.user)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def walk(self, **params) -> list[int]:
+        url = reverse('shopapp:product-list')
+        params['cursor'] = ''
+        pks = []
+        while url:
+            with self.assertNumQueries(1):
+                response = self.client.get(url, params)
+            data = response.json()
+            self.assertNotIn('count', data)
+            pks.extend(item['pk'] for item in data['results'])
+            url, params = data['next'], {}
+        return pks
+
+    def test_walk_all_pages(self):
+        for ordering in ('-price', 'price,name', 'discount', '-created_ad'):
+            expected = list(
+                Product.objects
+                .order_by(*ordering.split(','), 'pk')
+                .values_list('pk', flat=True)
+            )
+            self.assertEqual(self.walk(ordering=ordering), expected, ordering)
+
+    def test_page_number_is_default(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'page': 2})
+        self.assertEqual(response.json()['count'], 25)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductListQueryCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        Product.objects.create(name='Table', price=10, created_by=self.user)
+        self.url = reverse('shopapp:product-list')
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_cached_and_fresh_after_write(self):
+        response = self.client.get(self.url, {'ordering': '-price', 'archived': 'false'})
+        self.assertEqual(response.json()['count'], 1)
+        # порядок параметров не важен
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.url}?archived=false&ordering=-price')
+        self.assertEqual(response.json()['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Chair', price=5, created_by=self.user)
+        response = self.client.get(self.url, {'ordering': '-price', 'archived': 'false'})
+        self.assertEqual(response.json()['count'], 2)
+
+        product.archived = True
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        response = self.client.get(self.url, {'ordering': '-price', 'archived': 'false'})
+        self.assertEqual(response.json()['count'], 1)
+
+    def test_search_is_part_of_key(self):
+        self.assertEqual(self.client.get(self.url, {'search': 'Table'}).json()['count'], 1)
+        self.assertEqual(self.client.get(self.url, {'search': 'Chair'}).json()['count'], 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FastReadSerializersTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.products = [
+            Product.objects.create(name='Table', description='Wooden', price='10.5', discount=5, created_by=self.user,
+                                   preview='products/product 1/preview/table.png'),
+            Product.objects.create(name='Chair', description=None, price=3, created_by=self.user),
+            Product.objects.create(name='Chair', price='2.99', archived=True, created_by=self.user),
+        ]
+        self.order = Order.objects.create(user=self.user, delivery_address='Address', promocode='PROMO',
+                                          receipt='orders/receipt/1.pdf')
+        self.order.products.set(self.products)
+        # total and items_count were updated in the database by the m2m signal
+        self.order.refresh_from_db()
+        Order.objects.create(user=self.user)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def render_expected(self, path: str, serializer_class, instance, many: bool) -> bytes:
+        request = Request(RequestFactory().get(path))
+        data = serializer_class(instance, many=many, context={'request': request}).data
+        return JSONRenderer().render(data)
+
+    def test_products_match_model_serializer(self):
+        url = reverse('shopapp:product-detail', kwargs={'pk': self.products[0].pk})
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.content, self.render_expected(url, ProductSerializer, self.products[0], many=False))
+
+        url = reverse('shopapp:product-list')
+        response = self.client.get(url, {'cursor': ''}, HTTP_ACCEPT='application/json')
+        results = JSONRenderer().render(response.json()['results'])
+        self.assertEqual(results, self.render_expected(url, ProductSerializer, Product.objects.all(), many=True))
+
+    def test_orders_match_model_serializer(self):
+        url = reverse('shopapp:order-list')
+        # etag aggregate + orders page + products ids of the page + count
+        with self.assertNumQueries(4):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        results = JSONRenderer().render(response.json()['results'])
+        self.assertEqual(results, self.render_expected(url, OrderSerializer, Order.objects.order_by('pk'), many=True))
+
+        url = reverse('shopapp:order-detail', kwargs={'pk': self.order.pk})
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.content, self.render_expected(url, OrderSerializer, self.order, many=False))
+
+    def test_retrieve_not_found(self):
+        response = self.client.get(reverse('shopapp:order-detail', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_retrieve_checks_object_permissions(self):
+        url = reverse('shopapp:order-detail', kwargs={'pk': self.order.pk})
+        with mock.patch.object(OrderViewSet, 'check_object_permissions', side_effect=PermissionDenied) as check:
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 403)
+        obj = check.call_args.args[1]
+        self.assertIsInstance(obj, Order)
+        self.assertEqual(obj.pk, self.order.pk)
+        self.assertEqual(obj.user_id, self.user.pk)
+        # columns outside the serializer are loaded on access
+        self.assertEqual(obj.delivery_address, 'Address')
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SparseFieldsetsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.product = Product.objects.create(name='Table', description='Long text', price=10, created_by=self.user)
+        Order.objects.create(user=self.user).products.add(self.product)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_product_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shopapp:product-list'), {'fields': 'pk,name,price'})
+        self.assertEqual(response.json()['results'], [{'pk': self.product.pk, 'name': 'Table', 'price': '10.00'}])
+        select = queries.captured_queries[-1]['sql']
+        self.assertNotIn('description', select)
+        self.assertNotIn('preview', select)
+
+        response = self.client.get(
+            reverse('shopapp:product-detail', kwargs={'pk': self.product.pk}),
+            {'exclude': 'description,preview'},
+        )
+        self.assertNotIn('description', response.json())
+        self.assertIn('created_by', response.json())
+
+    def test_order_exclude_products_skips_m2m_query(self):
+        # etag aggregate + orders page + count, no products query
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('shopapp:order-list'), {'exclude': 'products'})
+        self.assertNotIn('products', response.json()['results'][0])
+
+    def test_unknown_field(self):
+        response = self.client.get(reverse('shopapp:product-list'), {'fields': 'pk,secret'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.product = Product.objects.create(name='Table', price=10, created_by=self.user)
+        self.order = Order.objects.create(user=self.user)
+        self.product_url = reverse('shopapp:product-detail', kwargs={'pk': self.product.pk})
+        self.order_url = reverse('shopapp:order-detail', kwargs={'pk': self.order.pk})
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_retrieve_not_modified(self):
+        response = self.client.get(self.product_url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.product_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.product_url, {'fields': 'pk,name'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_retrieve_not_modified_checks_permissions(self):
+        etag = self.client.get(self.product_url)['ETag']
+        with mock.patch('shopapp.views.ProductViewSet.check_object_permissions', side_effect=PermissionDenied):
+            response = self.client.get(self.product_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+
+    def test_etag_depends_on_renderer(self):
+        for url in (self.product_url, reverse('shopapp:product-list'), reverse('shopapp:order-list')):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertIn('Accept', response['Vary'])
+            response = self.client.get(url, HTTP_ACCEPT='text/html', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('text/html', response['Content-Type'])
+
+    def test_retrieve_missing(self):
+        response = self.client.get(reverse('shopapp:product-detail', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_retrieve_invalid_pk(self):
+        for url in ('/shop/api/products/abc/', '/shop/api/orders/abc/'):
+            response = self.client.get(url, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 404)
+
+    def test_archive_changes_etag(self):
+        etag = self.client.get(self.product_url)['ETag']
+        mark_archived(None, None, Product.objects.filter(pk=self.product.pk))
+        response = self.client.get(self.product_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['archived'])
+
+    def test_order_products_change_etag(self):
+        etag = self.client.get(self.order_url)['ETag']
+        list_etag = self.client.get(reverse('shopapp:order-list'))['ETag']
+        self.order.products.add(self.product)
+        response = self.client.get(self.order_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['products'], [self.product.pk])
+        response = self.client.get(reverse('shopapp:order-list'), HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.product.orders.clear()
+        response = self.client.get(reverse('shopapp:order-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_not_modified(self):
+        url = reverse('shopapp:product-list')
+        etag = self.client.get(url)['ETag']
+        # etag from the products version, no queries
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        url = reverse('shopapp:order-list')
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ProductBatchWriteTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.products = Product.objects.bulk_create(
+            Product(name=f'Product {i}', price=i, created_by=self.user) for i in range(3)
+        )
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_batch_create(self):
+        items = [
+            {'name': f'New {i}', 'price': '1.50', 'discount': i, 'created_by': self.user.pk}
+            for i in range(20)
+        ]
+        items.insert(5, {'name': 'Bad', 'price': 'x', 'created_by': self.user.pk})
+        items.append({'name': 'No user', 'price': 1, 'created_by': 0})
+        # users preload + savepoint + insert + facet counts + release, no per-item queries
+        with self.assertNumQueries(5):
+            response = self.client.post(
+                reverse('shopapp:product-batch-create'), items, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual([error['index'] for error in data['errors']], [5, 21])
+        self.assertIn('created_by', data['errors'][1]['errors'])
+        self.assertEqual(Product.objects.filter(name__startswith='New').count(), 20)
+
+    def test_batch_create_invalid_and_limit(self):
+        url = reverse('shopapp:product-batch-create')
+        response = self.client.post(url, [{'name': ''}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(url, {'name': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        with mock.patch('shopapp.views.ProductViewSet.batch_max_items', 2):
+            response = self.client.post(url, [{}, {}, {}], content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_batch_update(self):
+        list_etag = self.client.get(reverse('shopapp:product-list'))['ETag']
+        items = [
+            {'pk': self.products[0].pk, 'price': '9.99'},
+            {'pk': self.products[1].pk, 'discount': 5, 'name': 'Renamed'},
+            {'pk': 0, 'price': 1},
+            {'pk': self.products[2].pk, 'discount': 'x'},
+        ]
+        response = self.client.patch(
+            reverse('shopapp:product-batch-update'), items, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['pk'] for item in data['results']], [self.products[0].pk, self.products[1].pk])
+        self.assertEqual([error['index'] for error in data['errors']], [2, 3])
+        self.products[0].refresh_from_db()
+        self.products[1].refresh_from_db()
+        self.assertEqual(str(self.products[0].price), '9.99')
+        self.assertEqual((self.products[1].name, self.products[1].discount), ('Renamed', 5))
+        self.assertGreater(self.products[1].updated_at, self.products[2].updated_at)
+
+        response = self.client.get(reverse('shopapp:product-list'), HTTP_IF_NONE_MATCH=list_etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_batch_archive(self):
+        pks = [self.products[0].pk, self.products[2].pk, 0]
+        response = self.client.post(
+            reverse('shopapp:product-batch-archive'), pks, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['archived'], sorted(pks[:2]))
+        self.assertEqual(response.json()['errors'], [{'index': 2, 'errors': {'pk': ['Object not found']}}])
+        self.assertEqual(
+            set(Product.objects.filter(archived=True).values_list('pk', flat=True)),
+            set(pks[:2]),
+        )
+
+
+class ProductFullTextSearchTestCase(TestCase):
+    def setUp(self) -> None:
+        translation.activate('en')
+        self.user = User.objects.create_superuser(username='admin-user', password='12345')
+        self.table, self.lamp, self.chair = Product.objects.bulk_create([
+            Product(name='Wooden table', description='Oak', created_by=self.user),
+            Product(name='Desk lamp', description='For a wooden table', created_by=self.user),
+            Product(name='Chair', description='Plastic', created_by=self.user),
+        ])
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def search_api(self, term: str) -> list[int]:
+        response = self.client.get(reverse('shopapp:product-list'), {'search': term})
+        return [item['pk'] for item in response.json()['results']]
+
+    def test_ranked_prefix_search(self):
+        # name matches weigh more than description matches
+        self.assertEqual(self.search_api('woo tab'), [self.table.pk, self.lamp.pk])
+        self.assertEqual(self.search_api('plast'), [self.chair.pk])
+        self.assertEqual(self.search_api('"unknown'), [])
+
+    def test_index_follows_writes(self):
+        Product.objects.filter(pk=self.chair.pk).update(name='Wooden chair')
+        self.lamp.delete()
+        Product.objects.create(name='Woodcut', created_by=self.user)
+        self.assertEqual(
+            set(PRODUCTS_INDEX.search(Product.objects.all(), ['wood']).values_list('name', flat=True)),
+            {'Wooden table', 'Wooden chair', 'Woodcut'},
+        )
+
+    def test_ensure_rebuilds_after_table_remake(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {PRODUCTS_INDEX.table}_ai')
+        Product.objects.create(name='Wooden bench', created_by=self.user)
+        PRODUCTS_INDEX.ensure()
+        Product.objects.create(name='Wooden shelf', created_by=self.user)
+        self.assertEqual(len(self.search_api('wooden')), 4)
+
+    def test_admin_search(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('admin:shopapp_product_changelist'), {'q': 'lamp'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.lamp])
+
+
+class ProductFacetsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.cheap = Product.objects.create(name='Pen', price=5, created_by=self.user)
+        self.expensive = Product.objects.create(name='Sofa', price=1500, discount=30, created_by=self.user)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def assertStoredCountsActual(self):
+        self.assertEqual(stored_facet_counts(), facet_counts(Product.objects.all()))
+
+    def test_migration_fills_same_counts(self):
+        migration = import_module('shopapp.migrations.0010_productfacetcount')
+        Product.objects.create(name='Archived', price='99.99', discount=-1, archived=True, created_by=self.user)
+        ProductFacetCount.objects.all().delete()
+        migration.fill_facet_counts(django_apps, None)
+        self.assertStoredCountsActual()
+
+    def test_counts(self):
+        counts = facet_counts(Product.objects.all())
+        self.assertEqual(counts['archived'], {'false': 2, 'true': 0})
+        self.assertEqual(counts['discount']['0-1'], 1)
+        self.assertEqual(counts['discount']['25-50'], 1)
+        self.assertEqual(counts['price']['0-100'], 1)
+        self.assertEqual(counts['price']['1000-5000'], 1)
+        self.assertStoredCountsActual()
+
+    def test_stored_counts_follow_writes(self):
+        self.cheap.price = 200
+        self.cheap.save()
+        self.cheap.save(update_fields=['name'])
+        self.assertStoredCountsActual()
+
+        mark_archived(None, None, Product.objects.filter(pk=self.cheap.pk))
+        self.assertStoredCountsActual()
+
+        self.client.post(
+            reverse('shopapp:product-batch-create'),
+            [{'name': 'Cup', 'price': 1, 'created_by': self.user.pk}],
+            content_type='application/json',
+        )
+        self.assertStoredCountsActual()
+        self.client.patch(
+            reverse('shopapp:product-batch-update'),
+            [{'pk': self.expensive.pk, 'discount': 0}],
+            content_type='application/json',
+        )
+        self.assertStoredCountsActual()
+        self.client.post(
+            reverse('shopapp:product-batch-archive'), [self.expensive.pk], content_type='application/json'
+        )
+        self.assertStoredCountsActual()
+
+        content = f'name,description,price,discount,created_by,sku\nLamp,,7000,60,{self.user.pk},L-1\n'
+        stream_csv_products(BytesIO(content.encode()), encoding='utf-8')
+        upsert_csv_products(BytesIO(content.replace('7000', '10').encode()), encoding='utf-8')
+        self.assertStoredCountsActual()
+
+        self.cheap.delete()
+        self.assertStoredCountsActual()
+
+    def test_endpoint(self):
+        url = reverse('shopapp:product-facets')
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.json(), stored_facet_counts())
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'discount': 30})
+        data = response.json()
+        self.assertEqual(data['price']['1000-5000'], 1)
+        self.assertEqual(sum(data['archived'].values()), 1)
+
+
+class AsyncViewsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.product = Product.objects.create(name='Table', created_by=self.user)
+        Product.objects.create(name='Old chair', created_by=self.user, archived=True)
+        Order.objects.create(user=self.user).products.add(self.product)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_middleware_stack_is_async(self):
+        handler = ASGIHandler()
+        self.assertTrue(iscoroutinefunction(handler._middleware_chain))
+
+    async def test_products_list_and_details(self):
+        response = await self.async_client.get(reverse('shopapp:products_list'))
+        self.assertEqual([product.pk for product in response.context['products']], [self.product.pk])
+        self.assertTemplateUsed(response, 'shopapp/products-list.html')
+
+        response = await self.async_client.get(reverse('shopapp:products_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, 'Table')
+        response = await self.async_client.get(reverse('shopapp:products_details', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_exports_stream_async_under_asgi(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        products_id = f'"products_id":[{self.product.pk}]'.encode()
+        for url, expected in (
+            (reverse('shopapp:products_export'), b'"name":"Table"'),
+            (reverse('shopapp:orders_export'), products_id),
+            (reverse('shopapp:orders_export') + '?format=ndjson', products_id),
+        ):
+            response = await self.async_client.get(url)
+            # a sync iterator would be read into memory as a whole by the ASGI handler
+            self.assertTrue(response.is_async)
+            content = b''.join([part async for part in response.streaming_content])
+            self.assertIn(expected, content)
+
+    def test_exports_stay_sync_under_wsgi(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('shopapp:orders_export'))
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+
+    async def test_user_orders_export(self):
+        response = await self.async_client.get(
+            reverse('shopapp:user_orders_export', kwargs={'user_id': self.user.pk})
+        )
+        self.assertEqual(len(json.loads(response.content)['orders']), 1)
+
+
+class FastJSONTestCase(SimpleTestCase):
+    data = {
+        'price': Decimal('12.50'),
+        'created_at': datetime(2023, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+        'day': date(2023, 5, 1),
+        'title': gettext_lazy('Products'),
+        'text': 'Стол\u2028',
+        'items': [1, None, True],
+    }
+
+    def test_encoding_matches_stdlib(self):
+        self.assertEqual(json.loads(dumps(self.data)), json.loads(json.dumps(self.data, cls=DjangoJSONEncoder)))
+        response = FastJsonResponse(self.data)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), json.loads(dumps(self.data)))
+        with self.assertRaises(TypeError):
+            FastJsonResponse([1, 2])
+
+    def test_renderer_matches_drf(self):
+        fast = FastJSONRenderer().render(self.data, 'application/json')
+        self.assertEqual(json.loads(fast), json.loads(JSONRenderer().render(self.data, 'application/json')))
+        self.assertNotIn('\u2028'.encode(), fast)
+        # отступы отдаются стандартному рендереру
+        self.assertEqual(
+            FastJSONRenderer().render(self.data, 'application/json; indent=2'),
+            JSONRenderer().render(self.data, 'application/json; indent=2'),
+        )
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    @skipIf(fast_json.orjson is None, 'orjson is not installed')
+    def test_orjson_bytes_match(self):
+        # orjson writes compact utf-8, the same as the stdlib with these arguments
+        fast = dumps_bytes(self.data)
+        self.assertEqual(
+            fast, json.dumps(self.data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode(),
+        )
+        with mock.patch.object(fast_json, 'orjson', None):
+            # the stdlib fallback writes the same compact format
+            self.assertEqual(dumps_bytes(self.data), fast)
+        nested = {'results': [self.data, {'count': 2, 'ratio': 0.1}], 'next': None}
+        self.assertEqual(
+            FastJSONRenderer().render(nested, 'application/json'),
+            JSONRenderer().render(nested, 'application/json'),
+        )
+
+
+class OrderTotalsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='buyer', password='12345')
+        self.table = Product.objects.create(name='Table', price='100.00', created_by=self.user)
+        self.chair = Product.objects.create(name='Chair', price='25.50', created_by=self.user)
+        self.order = Order.objects.create(user=self.user)
+
+    def assertTotals(self, order: Order, total: str, items_count: int):
+        order.refresh_from_db()
+        self.assertEqual((order.total, order.items_count), (Decimal(total), items_count))
+
+    def test_migration_fills_totals(self):
+        migration = import_module('shopapp.migrations.0011_order_totals')
+        self.order.products.add(self.table, self.chair)
+        empty = Order.objects.create(user=self.user)
+        Order.objects.update(total=1, items_count=7)
+        migration.fill_order_totals(django_apps, None)
+        self.assertTotals(self.order, '125.50', 2)
+        self.assertTotals(empty, '0', 0)
+
+    def test_products_changes(self):
+        self.order.products.add(self.table, self.chair)
+        self.assertTotals(self.order, '125.50', 2)
+        self.order.products.remove(self.table)
+        self.assertTotals(self.order, '25.50', 1)
+        self.table.orders.add(self.order)
+        self.assertTotals(self.order, '125.50', 2)
+        self.chair.orders.clear()
+        self.assertTotals(self.order, '100.00', 1)
+        self.order.products.clear()
+        self.assertTotals(self.order, '0', 0)
+
+    def test_price_change_and_delete(self):
+        other = Order.objects.create(user=self.user)
+        self.order.products.add(self.table, self.chair)
+        other.products.add(self.table)
+        self.table.price = '90.00'
+        self.table.save()
+        self.assertTotals(self.order, '115.50', 2)
+        self.assertTotals(other, '90.00', 1)
+        self.chair.delete()
+        self.assertTotals(self.order, '90.00', 1)
+
+    def test_api_batch_update_price(self):
+        self.order.products.add(self.table)
+        self.client.force_login(User.objects.create_superuser(username='admin-user', password='12345'))
+        response = self.client.patch(
+            reverse('shopapp:product-batch-update'),
+            [{'pk': self.table.pk, 'price': '80.00'}],
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTotals(self.order, '80.00', 1)
+        data = self.client.get(reverse('shopapp:order-detail', kwargs={'pk': self.order.pk})).json()
+        self.assertEqual((data['total'], data['items_count']), ('80.00', 1))
+
+    def test_recompute_fixes_drift(self):
+        self.order.products.add(self.table)
+        Order.objects.filter(pk=self.order.pk).update(total=0, items_count=5)
+        self.assertEqual(recompute_all_order_totals(batch_size=1), 1)
+        self.assertTotals(self.order, '100.00', 1)
+        self.assertEqual(recompute_all_order_totals(), 0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class SalesAnalyticsTestCase(TestCase):
+    def setUp(self) -> None:
+        self.staff = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.table = Product.objects.create(name='Table', price='100.00', created_by=self.staff)
+        self.chair = Product.objects.create(name='Chair', price='25.50', created_by=self.staff)
+        self.lamp = Product.objects.create(name='Lamp', price='10.00', created_by=self.staff)
+        Order.objects.create(user=self.staff).products.add(self.table, self.chair)
+        Order.objects.create(user=self.staff).products.add(self.chair, self.lamp)
+        old = Order.objects.create(user=self.staff)
+        old.products.add(self.chair)
+        Order.objects.filter(pk=old.pk).update(created_at=datetime(2023, 1, 10, 12, tzinfo=timezone.utc))
+        Order.objects.create(user=self.staff)
+        self.url = reverse('shopapp:order-analytics')
+        self.client.force_login(self.staff)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_summary(self):
+        data = self.client.get(self.url, {'top': 2}).json()
+        self.assertEqual((data['orders'], data['items'], data['revenue']), (4, 5, '186.50'))
+        self.assertEqual((data['average_basket_size'], data['average_basket_value']), (1.25, '46.62'))
+        self.assertEqual(data['revenue_by_day'][0], {'day': '2023-01-10', 'orders': 1, 'revenue': '25.50'})
+        self.assertEqual(sum(day['orders'] for day in data['revenue_by_day']), 4)
+        self.assertEqual(
+            [(product['name'], product['quantity'], product['revenue']) for product in data['top_products']],
+            [('Table', 1, '100.00'), ('Chair', 3, '76.50')],
+        )
+
+        data = self.client.get(self.url, {'date_to': '2023-12-31'}).json()
+        self.assertEqual((data['orders'], data['revenue']), (1, '25.50'))
+        self.assertEqual(self.client.get(self.url, {'top': 0}).status_code, 400)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user(username='buyer', password='12345'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+    def test_cached_until_orders_change(self):
+        first = self.client.get(self.url).json()
+        # session, user and the orders state aggregate
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(self.url).json(), first)
+        self.lamp.price = '20.00'
+        self.lamp.save()
+        self.assertEqual(self.client.get(self.url).json()['revenue'], '196.50')
+
+    @skipIf(analytics.np is None, 'numpy is not installed')
+    def test_numpy_matches_python(self):
+        orders = Order.objects.all()
+        self.assertEqual(
+            analytics.sales_summary(orders, use_numpy=True),
+            analytics.sales_summary(orders, use_numpy=False),
+        )
+
+
+class SalesRollupTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_user(username='staff', password='12345', is_staff=True)
+        self.table = Product.objects.create(name='Table', price='100.00', created_by=self.user)
+        self.chair = Product.objects.create(name='Chair', price='25.50', created_by=self.user)
+        self.order = Order.objects.create(user=self.user)
+        self.order.products.add(self.table, self.chair)
+        old = Order.objects.create(user=self.user)
+        old.products.add(self.chair)
+        Order.objects.filter(pk=old.pk).update(created_at=datetime(2023, 1, 10, 12, tzinfo=timezone.utc))
+
+    def rollup(self):
+        return run_rollup(lag=timedelta(0))
+
+    def daily(self) -> list[tuple]:
+        return list(DailySales.objects.values_list('day', 'orders', 'items', 'revenue'))
+
+    def test_incremental_run(self):
+        self.assertEqual(self.rollup().orders, 2)
+        today = self.order.created_at.date()
+        self.assertEqual(self.daily(), [
+            (date(2023, 1, 10), 1, 1, Decimal('25.50')),
+            (today, 1, 2, Decimal('125.50')),
+        ])
+        self.assertEqual(
+            DailyUserSales.objects.get(day=today, user=self.user).revenue, Decimal('125.50'),
+        )
+
+        Order.objects.create(user=self.user).products.add(self.table)
+        result = self.rollup()
+        self.assertEqual((result.orders, result.recomputed_days), (1, []))
+        self.assertEqual(self.daily()[1], (today, 2, 3, Decimal('225.50')))
+        self.assertEqual(
+            list(DailyProductSales.objects.filter(day=today).values_list('product__name', 'quantity', 'revenue')),
+            [('Chair', 1, Decimal('25.50')), ('Table', 2, Decimal('200.00'))],
+        )
+
+    def test_late_edits_recompute_days(self):
+        self.rollup()
+        today = self.order.created_at.date()
+        old = Order.objects.get(created_at__year=2023)
+        old.products.add(self.table)
+        self.order.delete()
+        result = self.rollup()
+        self.assertEqual(result.orders, 0)
+        self.assertEqual(result.recomputed_days, [date(2023, 1, 10), today])
+        self.assertEqual(self.daily(), [(date(2023, 1, 10), 1, 2, Decimal('125.50'))])
+
+    def test_late_commit_is_not_missed(self):
+        run_rollup(lag=timedelta(minutes=5))
+        # an edit committed after the run, stamped before it started
+        Order.objects.filter(created_at__year=2023).update(
+            total='50.00', updated_at=django_timezone.now() - timedelta(minutes=1),
+        )
+        result = run_rollup(lag=timedelta(minutes=5))
+        self.assertEqual(result.recomputed_days, [date(2023, 1, 10)])
+        self.assertEqual(self.daily()[0], (date(2023, 1, 10), 1, 1, Decimal('50.00')))
+
+    def test_analytics_from_rollups(self):
+        self.rollup()
+        self.client.force_login(self.user)
+        url = reverse('shopapp:order-analytics')
+        with override_settings(CACHES=LOCMEM_CACHES):
+            live = self.client.get(url).json()
+            data = self.client.get(url, {'source': 'rollup'}).json()
+        self.assertIsNotNone(data.pop('watermark'))
+        self.assertEqual(data, live)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProductsListPaginationTestCase(TestCase):
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def setUp(self) -> None:
+        self.users = [
+            User.objects.create_user(username=f'user{i}', first_name='Ann' if i == 0 else '', password='12345')
+            for i in range(3)
+        ]
+        self.url = reverse('shopapp:products_list')
+
+    def create_products(self, count: int) -> None:
+        Product.objects.bulk_create(
+            Product(name=f'Product {i:02}', price=i % 3, created_by=self.users[i % 3])
+            for i in range(count)
+        )
+
+    def test_page_queries_do_not_grow(self):
+        self.create_products(3)
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url)
+        Product.objects.all().delete()
+        self.create_products(45)
+        # the page with the creator name is a single query
+        with self.assertNumQueries(len(small)):
+            response = self.client.get(self.url)
+        self.assertEqual(len(small), 1)
+        self.assertEqual(len(response.context['products']), 20)
+        self.assertContains(response, 'Created by: Ann')
+        self.assertContains(response, 'Created by: user1')
+
+    def test_load_more(self):
+        self.create_products(45)
+        Product.objects.create(name='Archived', created_by=self.users[0], archived=True)
+        names = []
+        params = {}
+        while True:
+            response = self.client.get(self.url, params)
+            names.extend(product.name for product in response.context['products'])
+            if response.context['next_cursor'] is None:
+                break
+            self.assertContains(response, 'Load more')
+            params = {'cursor': response.context['next_cursor']}
+        self.assertEqual(names, list(Product.objects.filter(archived=False).values_list('name', flat=True)))
+        self.assertEqual(self.client.get(self.url, {'cursor': 'broken'}).status_code, 400)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class FragmentCacheTestCase(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create_superuser(username='admin-user', password='12345')
+        self.table = Product.objects.create(name='Table', price=10, created_by=self.user)
+        self.chair = Product.objects.create(name='Chair', price=5, created_by=self.user)
+        self.order = Order.objects.create(user=self.user, delivery_address='Address')
+        self.order.products.add(self.table)
+
+    def tearDown(self) -> None:
+        cache.clear()
+
+    def test_products_list_renders_only_changed_cards(self):
+        self.client.get(reverse('shopapp:products_list'))
+        # a rename without updated_at keeps the cached card
+        Product.objects.filter(pk=self.chair.pk).update(name='Stool')
+        with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            response = self.client.get(reverse('shopapp:products_list'))
+        get_many.assert_called_once()
+        self.assertContains(response, 'Chair')
+        self.assertNotContains(response, 'Stool')
+
+        self.chair.refresh_from_db()
+        self.chair.save()
+        self.assertContains(self.client.get(reverse('shopapp:products_list')), 'Stool')
+
+    def test_order_rows_follow_product_changes(self):
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(reverse('shopapp:orders_list')), 'Table for $10.00')
+        self.table.name = 'Desk'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.table.save()
+        self.assertContains(self.client.get(reverse('shopapp:orders_list')), 'Desk for $10.00')
+
+    def products_prefetches(self, queries) -> list[str]:
+        # order ids of each products prefetch query
+        matches = (re.search(r'"shopapp_order_products"\."order_id" IN \(([^)]*)\)', query['sql']) for query in queries)
+        return [match.group(1) for match in matches if match]
+
+    def test_unrelated_product_write_keeps_order_rows(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('shopapp:orders_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.chair.save()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(reverse('shopapp:orders_list')), 'Table for $10.00')
+        self.assertEqual(self.products_prefetches(queries), [])
+
+    def test_order_products_prefetched_only_for_misses(self):
+        self.client.force_login(self.user)
+        other = Order.objects.create(user=self.user)
+        other.products.add(self.chair)
+        self.client.get(reverse('shopapp:orders_list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shopapp:orders_list'))
+        self.assertContains(response, 'Chair for $5.00')
+        self.assertEqual(self.products_prefetches(queries), [])
+
+        Order.objects.filter(pk=other.pk).update(promocode='NEW', updated_at=django_timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('shopapp:orders_list'))
+        self.assertContains(response, 'NEW')
+        self.assertEqual(self.products_prefetches(queries), [str(other.pk)])
+
+    def test_details_follow_images(self):
+        url = reverse('shopapp:products_details', kwargs={'pk': self.table.pk})
+        self.assertContains(self.client.get(url), 'No images uploaded yet')
+        with TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            self.table.images.create(image='products/table.png', description='Top view')
+            self.assertContains(self.client.get(url), 'Top view')
+
+    def test_details_prefetch_images_only_on_miss(self):
+        url = reverse('shopapp:products_details', kwargs={'pk': self.table.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual(len([query for query in queries if 'shopapp_productimage' in query['sql']]), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertContains(self.client.get(url), 'No images uploaded yet')
+        self.assertFalse([query for query in queries if 'shopapp_productimage' in query['sql']])
+
+    def test_key_depends_on_language(self):
+        with translation.override('en'):
+            english = fragment_key('product_card', 1, ['v1'])
+        with translation.override('ru'):
+            self.assertNotEqual(fragment_key('product_card', 1, ['v1']), english)
+            self.assertNotEqual(fragment_key('product_card', 1, ['v2']), fragment_key('product_card', 1, ['v1']))
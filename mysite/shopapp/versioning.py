@@ -0,0 +1,72 @@
+"""
+Счётчики версий данных в кэше.
+
+Версия меняется при каждом изменении данных (см. shopapp.signals),
+поэтому ключи кэша, содержащие версию, можно хранить долго:
+после изменения старые ключи просто перестают читаться.
+Записи внутри транзакции сбрасывают версии через bump_versions_on_commit:
+иначе чтение до фиксации успело бы закэшировать старые данные под новой версией.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+PRODUCTS_VERSION = 'products'
+
+
+def user_orders_version(user_id: int) -> str:
+    return f'user_orders_{user_id}'
+
+
+def version_key(name: str) -> str:
+    return f'shopapp_version_{name}'
+
+
+def get_version(name: str) -> int:
+    key = version_key(name)
+    version = cache.get(key)
+    if version is None:
+        # время в наносекундах, чтобы после вытеснения ключа из кэша
+        # версия не совпала ни с одной из уже выданных
+        version = time.time_ns()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+async def aget_version(name: str) -> int:
+    """
+    get_version для async представлений
+    """
+    key = version_key(name)
+    version = await cache.aget(key)
+    if version is None:
+        version = time.time_ns()
+        if not await cache.aadd(key, version, None):
+            version = await cache.aget(key, version)
+    return version
+
+
+def bump_versions(names) -> None:
+    for name in set(names):
+        bump_version(name)
+
+
+def bump_versions_on_commit(names) -> None:
+    """
+    bump_versions после фиксации текущей транзакции, вне транзакции - сразу
+    """
+    names = set(names)
+    if names:
+        transaction.on_commit(lambda: bump_versions(names))
+
+
+def bump_version(name: str) -> int:
+    key = version_key(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, None)
+        return version
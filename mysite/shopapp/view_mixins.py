@@ -0,0 +1,371 @@
+from hashlib import md5
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import QuerySet, Count, Max, Model
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .serializers import ValuesRowSerializer
+from .versioning import bump_version, get_version
+
+
+def lookup_first(view, queryset: QuerySet):
+    """
+    Первая строка queryset по lookup_field из URL, семантика get_object_or_404:
+    значение неподходящего типа (/products/abc/) - 404, а не ошибка сервера
+    """
+    lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+    try:
+        row = queryset.filter(**{view.lookup_field: view.kwargs[lookup_url_kwarg]}).first()
+    except (TypeError, ValueError, DjangoValidationError):
+        raise Http404
+    if row is None:
+        raise Http404
+    return row
+
+
+def row_instance(model: type[Model], row: dict) -> Model:
+    """
+    Экземпляр модели из строки values() для проверки прав.
+    Поля, которых нет в строке, отложены и загрузятся при обращении
+    """
+    row = {**row, model._meta.pk.attname: row['pk']}
+    fields = [field for field in model._meta.concrete_fields if field.attname in row]
+    return model.from_db(None, [field.attname for field in fields], [row[field.attname] for field in fields])
+
+
+class ConditionalGetMixin:
+    """
+    ETag и Last-Modified для list и retrieve по полю updated_at.
+    Если у клиента актуальная версия, ответ 304 строится одним запросом
+    к индексу updated_at, без чтения строк и сериализации.
+    ETag зависит от выбранного рендерера, ответ помечается Vary: Accept.
+    Должен стоять в MRO раньше кэширующих и читающих миксинов
+    """
+    last_modified_field = 'updated_at'
+
+    def get_params_digest(self, request: Request) -> str:
+        # разные параметры (фильтры, страница, fields) - разные представления
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            for value in values
+        )
+        return md5(repr(params).encode()).hexdigest()
+
+    def get_representation(self, request: Request) -> str:
+        # JSON и browsable API одного объекта - разные представления
+        return '{}-{}'.format(request.accepted_renderer.format, request.accepted_media_type)
+
+    def get_conditional_queryset(self) -> QuerySet:
+        return self.filter_queryset(self.get_queryset()).prefetch_related(None)
+
+    def get_retrieve_validators(self, request: Request) -> tuple[str, float]:
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_conditional_queryset()
+        row = lookup_first(self, queryset.values('pk', self.last_modified_field))
+        # 304 тоже раскрывает существование объекта, права проверяются до него
+        self.check_object_permissions(request, row_instance(queryset.model, row))
+        updated_at = row[self.last_modified_field]
+        etag = '{}-{}-{}-{}'.format(
+            self.kwargs[lookup_url_kwarg],
+            updated_at.timestamp(),
+            self.get_params_digest(request),
+            self.get_representation(request),
+        )
+        return etag, updated_at.timestamp()
+
+    def get_list_validators(self, request: Request) -> tuple[str, float | None]:
+        list_cache_version = getattr(self, 'list_cache_version', None)
+        if list_cache_version is not None:
+            # версия данных уже есть в кэше, запрос к базе не нужен
+            etag = 'list-{}-{}-{}'.format(
+                get_version(list_cache_version),
+                self.get_params_digest(request),
+                self.get_representation(request),
+            )
+            return etag, None
+        # count меняется при удалении, max(updated_at) - при любой записи
+        aggregated = self.get_conditional_queryset().order_by().aggregate(
+            last_modified=Max(self.last_modified_field),
+            count=Count('pk'),
+        )
+        last_modified = aggregated['last_modified']
+        timestamp = last_modified.timestamp() if last_modified is not None else None
+        etag = 'list-{}-{}-{}-{}'.format(
+            aggregated['count'],
+            timestamp,
+            self.get_params_digest(request),
+            self.get_representation(request),
+        )
+        return etag, timestamp
+
+    def conditional_response(self, request: Request, validators: tuple[str, float | None], view_method, *args, **kwargs):
+        etag, timestamp = validators
+        etag = quote_etag(md5(etag.encode()).hexdigest())
+        last_modified = int(timestamp) if timestamp is not None else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = view_method(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        return self.conditional_response(request, self.get_list_validators(request), super().list, *args, **kwargs)
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        return self.conditional_response(
+            request, self.get_retrieve_validators(request), super().retrieve, *args, **kwargs
+        )
+
+
+class VersionedListCacheMixin:
+    """
+    Кэш результатов list для ModelViewSet.
+    Ключ строится из нормализованных параметров запроса (фильтры, поиск,
+    сортировка, страница) и версии данных list_cache_version, которую
+    увеличивают записи в модель. Поэтому чтение всегда свежее,
+    а записи в кэше могут жить часами
+    """
+    list_cache_version: str
+    list_cache_timeout = 60 * 60 * 6
+    list_cache_ignored_params = ('format',)
+
+    def get_list_cache_key(self, request: Request) -> str:
+        params = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in self.list_cache_ignored_params
+            for value in values
+            if value != '' or key == 'cursor'
+        )
+        # ссылки next/previous и url картинок зависят от хоста
+        raw_key = repr((request.scheme, request.get_host(), params))
+        return 'api_list_{name}_{version}_{digest}'.format(
+            name=self.list_cache_version,
+            version=get_version(self.list_cache_version),
+            digest=md5(raw_key.encode()).hexdigest(),
+        )
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        cache_key = self.get_list_cache_key(request)
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+        response = super().list(request, *args, **kwargs)
+        cache.set(cache_key, response.data, self.list_cache_timeout)
+        return response
+
+
+class FastReadMixin:
+    """
+    list и retrieve через ValuesRowSerializer: строки читаются через values(),
+    связи M2M подгружаются списками id одним запросом на страницу
+    """
+
+    def get_values_serializer(self) -> ValuesRowSerializer:
+        return ValuesRowSerializer(self.get_serializer())
+
+    def get_values_queryset(self, values_serializer: ValuesRowSerializer) -> QuerySet:
+        queryset = self.filter_queryset(self.get_queryset())
+        # поля сортировки нужны keyset-пагинации для построения курсора
+        ordering_columns = [
+            field.attname
+            for field in queryset.model._meta.concrete_fields
+            if field.name in getattr(self, 'ordering_fields', ())
+        ]
+        return queryset.values(*dict.fromkeys([*values_serializer.columns, *ordering_columns]))
+
+    def list(self, request: Request, *args, **kwargs) -> Response:
+        values_serializer = self.get_values_serializer()
+        queryset = self.get_values_queryset(values_serializer)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.serialize(list(page)))
+        return Response(values_serializer.serialize(list(queryset)))
+
+    def retrieve(self, request: Request, *args, **kwargs) -> Response:
+        values_serializer = self.get_values_serializer()
+        queryset = self.get_values_queryset(values_serializer)
+        row = lookup_first(self, queryset)
+        self.check_object_permissions(request, row_instance(queryset.model, row))
+        return Response(values_serializer.serialize([row])[0])
+
+
+class SparseFieldsetsMixin:
+    """
+    Параметры ?fields=a,b и ?exclude=c для GET запросов.
+    Урезают сериализатор и список колонок, читаемых из базы
+    """
+    fields_query_param = 'fields'
+    exclude_query_param = 'exclude'
+
+    def get_sparse_fieldsets(self) -> dict:
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return {}
+        available = self.get_serializer_class().Meta.fields
+        kwargs = {}
+        for param in (self.fields_query_param, self.exclude_query_param):
+            value = self.request.query_params.get(param)
+            if not value:
+                continue
+            names = [name.strip() for name in value.split(',') if name.strip()]
+            unknown = [name for name in names if name not in available]
+            if unknown:
+                raise ValidationError({param: f'Unknown fields: {", ".join(unknown)}'})
+            kwargs['fields' if param == self.fields_query_param else 'exclude'] = names
+        return kwargs
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.update(self.get_sparse_fieldsets())
+        return super().get_serializer(*args, **kwargs)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        sparse_fieldsets = self.get_sparse_fieldsets()
+        if not sparse_fieldsets:
+            return queryset
+        serializer = self.get_serializer()
+        model = queryset.model
+        concrete = {field.name for field in model._meta.concrete_fields}
+        columns = [
+            field.source
+            for field in serializer.fields.values()
+            if field.source in concrete
+        ]
+        return queryset.only(model._meta.pk.name, *columns)
+
+
+def parse_pk(value) -> int | None:
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchWriteMixin:
+    """
+    Пакетные batch_create и batch_update для ModelViewSet без записываемых M2M.
+    Массив элементов проверяется сериализатором за один проход, связанные
+    объекты загружаются одним запросом на пакет, запись выполняется
+    bulk_create/bulk_update в одной транзакции.
+    Ошибочные элементы не прерывают пакет и возвращаются в errors с индексом
+    """
+    batch_max_items = 500
+    batch_size = 500
+
+    def get_batch_items(self, request: Request) -> list:
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items']})
+        if len(items) > self.batch_max_items:
+            raise ValidationError({'non_field_errors': [f'No more than {self.batch_max_items} items per request']})
+        return items
+
+    def get_batch_context(self, items: list) -> dict:
+        context = self.get_serializer_context()
+        preloaded = {}
+        for name, field in self.get_serializer_class()().fields.items():
+            if not isinstance(field, PrimaryKeyRelatedField) or field.read_only:
+                continue
+            ids = {parse_pk(item.get(name)) for item in items if isinstance(item, dict)}
+            queryset = field.get_queryset()
+            preloaded[queryset.model] = queryset.in_bulk(ids - {None})
+        context['preloaded'] = preloaded
+        return context
+
+    def batch_written(self) -> None:
+        # bulk_create и bulk_update не отправляют сигналы
+        list_cache_version = getattr(self, 'list_cache_version', None)
+        if list_cache_version is not None:
+            bump_version(list_cache_version)
+
+    def perform_batch_create(self, objects: list) -> None:
+        with transaction.atomic():
+            self.get_serializer_class().Meta.model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def perform_batch_update(self, objects: list, fields: set[str]) -> None:
+        with transaction.atomic():
+            self.get_serializer_class().Meta.model.objects.bulk_update(objects, fields, batch_size=self.batch_size)
+
+    def batch_response(self, objects: list, errors: list, context: dict, success_status: int) -> Response:
+        serializer = self.get_serializer_class()(objects, many=True, context=context)
+        response_status = status.HTTP_400_BAD_REQUEST if errors and not objects else success_status
+        return Response({'results': serializer.data, 'errors': errors}, status=response_status)
+
+    @action(methods=['post'], detail=False)
+    def batch_create(self, request: Request) -> Response:
+        items = self.get_batch_items(request)
+        context = self.get_batch_context(items)
+        serializer_class = self.get_serializer_class()
+        model = serializer_class.Meta.model
+        objects = []
+        errors = []
+        for index, item in enumerate(items):
+            serializer = serializer_class(data=item, context=context)
+            if serializer.is_valid():
+                objects.append(model(**serializer.validated_data))
+            else:
+                errors.append({'index': index, 'errors': serializer.errors})
+
+        if objects:
+            self.perform_batch_create(objects)
+            self.batch_written()
+        return self.batch_response(objects, errors, context, status.HTTP_201_CREATED)
+
+    @action(methods=['patch'], detail=False)
+    def batch_update(self, request: Request) -> Response:
+        """
+        Частичное обновление, каждый элемент содержит pk изменяемого объекта
+        """
+        items = self.get_batch_items(request)
+        context = self.get_batch_context(items)
+        serializer_class = self.get_serializer_class()
+        model = serializer_class.Meta.model
+        instances = self.get_queryset().in_bulk({
+            parse_pk(item.get('pk')) for item in items if isinstance(item, dict)
+        } - {None})
+        updated = {}
+        fields = set()
+        errors = []
+        for index, item in enumerate(items):
+            instance = instances.get(parse_pk(item.get('pk')) if isinstance(item, dict) else None)
+            if instance is None:
+                errors.append({'index': index, 'errors': {'pk': ['Object not found']}})
+                continue
+            serializer = serializer_class(instance, data=item, partial=True, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            for attr, value in serializer.validated_data.items():
+                setattr(instance, attr, value)
+            fields.update(serializer.validated_data)
+            updated[instance.pk] = instance
+
+        if updated and fields:
+            # bulk_update не заполняет auto_now поля
+            now = timezone.now()
+            for field in model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False):
+                    fields.add(field.name)
+                    for instance in updated.values():
+                        setattr(instance, field.attname, now)
+            self.perform_batch_update(list(updated.values()), fields)
+            self.batch_written()
+        return self.batch_response(list(updated.values()), errors, context, status.HTTP_200_OK)
@@ -5,34 +5,57 @@
 """
 import logging
 import json
+from collections import defaultdict
 from timeit import default_timer
-from csv import DictWriter
 
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import Group, User
 from django.contrib.syndication.views import Feed
-from django.http import HttpResponse, HttpRequest, HttpResponseRedirect, JsonResponse
+from django.http import (HttpResponse, HttpRequest, HttpResponseRedirect, HttpResponseBadRequest,
+                         JsonResponse, StreamingHttpResponse, Http404)
 from django.shortcuts import render, redirect, reverse, get_object_or_404
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.decorators.cache import cache_page
+from django.views.decorators.http import etag
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, QuerySet, Prefetch, Value
+from django.db.models.functions import Coalesce, NullIf
 
+from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework.request import Request
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
+from mysite.fts import FTSSearchFilter
+
+from .analytics import sales_state, sales_summary
 from .common import save_csv_products
-from .models import Product, Order, ProductImage
+from .fast_json import FastJsonResponse
+from .facets import apply_facet_deltas, facet_counts, facet_deltas, stored_facet_counts, track_facet_counts
+from .models import Product, Order, ProductImage, SalesRollupState
+from .order_totals import recompute_products_orders
+from .pagination import KeysetOrPageNumberPagination
+from .rollups import rollup_sales_summary
+from .search import PRODUCTS_INDEX
 from .forms import ProductForm, OrderForm, GroupForm
-from .serializers import ProductSerializer, OrderSerializer
+from .serializers import ProductSerializer, OrderSerializer, SalesAnalyticsQuerySerializer
+from .streaming import iter_csv_lines, iter_json_list, iter_ndjson, stream_parts, EXPORT_CHUNK_SIZE
+from .versioning import aget_version, get_version, user_orders_version, PRODUCTS_VERSION
+from .view_mixins import (ConditionalGetMixin, VersionedListCacheMixin, FastReadMixin, SparseFieldsetsMixin,
+                          BatchWriteMixin, parse_pk)
 
 log = logging.getLogger(__name__)
 
@@ -54,37 +77,70 @@ class UserOrdersListView(LoginRequiredMixin, ListView):
         return context
 
 
+def iter_orders_data(queryset: QuerySet, batch_size: int = EXPORT_CHUNK_SIZE):
+    """
+    Обходит заказы пачками по первичному ключу (keyset pagination).
+    id товаров каждой пачки берутся из таблицы связи одним запросом
+    """
+    through = Order.products.through
+    fields = ('id', 'delivery_address', 'promocode', 'user_id')
+    last_id = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_id is not None:
+            batch = batch.filter(pk__gt=last_id)
+        rows = list(batch.values_list(*fields)[:batch_size])
+        if not rows:
+            return
+        products_ids = defaultdict(list)
+        links = (
+            through.objects
+            .filter(order_id__in=[row[0] for row in rows])
+            .order_by('product__name', 'product__price', 'product_id')
+            .values_list('order_id', 'product_id')
+        )
+        for order_id, product_id in links:
+            products_ids[order_id].append(product_id)
+        for row in rows:
+            order_data = dict(zip(fields, row))
+            order_data['products_id'] = products_ids[row[0]]
+            yield order_data
+        last_id = rows[-1][0]
+
+
 class UserOrdersExportView(View):
-    def get(self, request: HttpRequest, user_id) -> JsonResponse:
-        cache_key = f'user_orders_data_export_{user_id}'
-        orders_data = cache.get(cache_key)
+    """
+    Выгрузка заказов пользователя в JSON.
+    Ключ кэша содержит версию заказов пользователя, которую меняют сигналы
+    Order и Order.products, поэтому кэш можно хранить долго
+    """
+    cache_timeout = 60 * 60 * 6
+
+    async def get(self, request: HttpRequest, user_id) -> FastJsonResponse:
+        cache_key = f'user_orders_data_export_{user_id}_{await aget_version(user_orders_version(user_id))}'
+        orders_data = await cache.aget(cache_key)
         if orders_data is None:
-            user = get_object_or_404(User, id=user_id)
-            orders = Order.objects.filter(user=user).order_by('pk')
-            orders_data = [
-                {
-                    'id': order.id,
-                    'delivery_address': order.delivery_address,
-                    'promocode': order.promocode,
-                    'user_id': order.user_id,
-                    'products_id': [product.id for product in order.products.all()],
-                }
-                for order in orders
-            ]
-            cache.set(cache_key, orders_data, 300)
-        return JsonResponse({'orders': orders_data})
+            if not await User.objects.filter(id=user_id).aexists():
+                raise Http404
+            orders_data = await sync_to_async(list)(iter_orders_data(Order.objects.filter(user_id=user_id)))
+            await cache.aset(cache_key, orders_data, self.cache_timeout)
+        return FastJsonResponse({'orders': orders_data})
 
 
 @extend_schema(description='Product views CRUD')
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(ConditionalGetMixin, VersionedListCacheMixin, SparseFieldsetsMixin, FastReadMixin,
+                     BatchWriteMixin, ModelViewSet):
     """
     Набор представлений для действий над Product
     Полный CRUD для сущностей товара
     """
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetOrPageNumberPagination
+    list_cache_version = PRODUCTS_VERSION
+    search_index = PRODUCTS_INDEX
     filter_backends = [
-        SearchFilter,
+        FTSSearchFilter,
         DjangoFilterBackend,
         OrderingFilter,
     ]
@@ -100,19 +156,11 @@ class ProductViewSet(ModelViewSet):
         'name',
         'price',
         'discount',
+        'created_ad',
     ]
 
-    @method_decorator(cache_page(60 * 2))
-    def list(self, request, *args, **kwargs):
-        # print('Hello products list')
-        return super().list(request, *args, **kwargs)
-
     @action(methods=['get'], detail=False)
     def download_csv(self, request: Request):
-        response = HttpResponse(content_type='text/csv')
-        filename = 'products-export.csv'
-        response['Content-Disposition'] = f'attachment; filename={filename}'
-        queryset = self.filter_queryset(self.get_queryset())
         fields = [
             'name',
             'description',
@@ -120,17 +168,56 @@ class ProductViewSet(ModelViewSet):
             'discount',
             'archived',
         ]
-        queryset = queryset.only(*fields)
-        writer = DictWriter(response, fieldnames=fields)
-        writer.writeheader()
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(stream_parts(request, iter_csv_lines(fields, rows)), content_type='text/csv')
+        filename = 'products-export.csv'
+        response['Content-Disposition'] = f'attachment; filename={filename}'
+        return response
 
-        for product in queryset:
-            writer.writerow({
-                field: getattr(product, field)
-                for field in fields
-            })
+    def perform_batch_create(self, objects: list[Product]) -> None:
+        with transaction.atomic():
+            Product.objects.bulk_create(objects, batch_size=self.batch_size)
+            apply_facet_deltas(facet_deltas(objects))
 
-        return response
+    def perform_batch_update(self, objects: list[Product], fields: set[str]) -> None:
+        with transaction.atomic():
+            with track_facet_counts((product.pk for product in objects), fields):
+                Product.objects.bulk_update(objects, fields, batch_size=self.batch_size)
+            if 'price' in fields:
+                recompute_products_orders(product.pk for product in objects)
+
+    @extend_schema(description='Product counts for every facet value of the current filters')
+    @action(methods=['get'], detail=False)
+    def facets(self, request: Request):
+        """
+        Счётчики фасетов. Без фильтров читаются из таблицы ProductFacetCount,
+        с фильтрами считаются одним GROUP BY запросом
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if queryset.query.has_filters():
+            return Response(facet_counts(queryset))
+        return Response(stored_facet_counts())
+
+    @action(methods=['post'], detail=False)
+    def batch_archive(self, request: Request):
+        """
+        Архивирует товары по списку pk одним UPDATE
+        """
+        items = self.get_batch_items(request)
+        pks = [parse_pk(item) for item in items]
+        existing = set(self.get_queryset().filter(pk__in=set(pks) - {None}).values_list('pk', flat=True))
+        errors = [
+            {'index': index, 'errors': {'pk': ['Object not found']}}
+            for index, pk in enumerate(pks)
+            if pk not in existing
+        ]
+        if existing:
+            with track_facet_counts(existing):
+                Product.objects.filter(pk__in=existing).update(archived=True, updated_at=timezone.now())
+            self.batch_written()
+        response_status = status.HTTP_400_BAD_REQUEST if errors and not existing else status.HTTP_200_OK
+        return Response({'archived': sorted(existing), 'errors': errors}, status=response_status)
 
     @action(
         detail=False,
@@ -157,9 +244,12 @@ class ProductViewSet(ModelViewSet):
         return super().retrieve(*args, **kwargs)
 
 
-class OrderViewSet(ModelViewSet):
-    queryset = Order.objects.all()
+class OrderViewSet(ConditionalGetMixin, SparseFieldsetsMixin, FastReadMixin, ModelViewSet):
+    queryset = Order.objects.prefetch_related(
+        Prefetch('products', queryset=Product.objects.only('pk')),
+    )
     serializer_class = OrderSerializer
+    pagination_class = KeysetOrPageNumberPagination
     filter_backends = [
         DjangoFilterBackend,
         OrderingFilter,
@@ -176,6 +266,51 @@ class OrderViewSet(ModelViewSet):
         'products',
         'created_at',
     ]
+    analytics_cache_timeout = 60 * 60
+
+    @extend_schema(
+        description='Revenue by day, top products and average basket for staff users',
+        parameters=[SalesAnalyticsQuerySerializer],
+    )
+    @action(methods=['get'], detail=False, permission_classes=[IsAdminUser])
+    def analytics(self, request: Request):
+        """
+        Сводка продаж. Результат кэшируется, ключ включает состояние заказов
+        (количество и последний updated_at) и версию товаров.
+        С source=rollup читается из таблиц дневных итогов без кэша
+        """
+        params = SalesAnalyticsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if params.validated_data['source'] == 'rollup':
+            data = rollup_sales_summary(
+                params.validated_data.get('date_from'),
+                params.validated_data.get('date_to'),
+                top=params.validated_data['top'],
+            )
+            state = SalesRollupState.objects.first()
+            data['watermark'] = state.watermark if state else None
+            return Response(data)
+
+        orders = Order.objects.all()
+        if 'date_from' in params.validated_data:
+            orders = orders.filter(created_at__date__gte=params.validated_data['date_from'])
+        if 'date_to' in params.validated_data:
+            orders = orders.filter(created_at__date__lte=params.validated_data['date_to'])
+
+        count, updated_at = sales_state(orders)
+        cache_key = 'shopapp_sales_analytics_{}_{}_{}_{}_{}_{}'.format(
+            get_version(PRODUCTS_VERSION),
+            count,
+            updated_at.timestamp() if updated_at else 0,
+            params.validated_data.get('date_from', ''),
+            params.validated_data.get('date_to', ''),
+            params.validated_data['top'],
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            data = sales_summary(orders, top=params.validated_data['top'])
+            cache.set(cache_key, data, self.analytics_cache_timeout)
+        return Response(data)
 
 
 class ShopIndexView(View):
@@ -213,18 +348,62 @@ class GroupsListView(View):
         return redirect(request.path)
 
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(View):
+    """
+    Async представление: товар читается через async ORM,
+    шаблон рендерится в потоке, так как контекстные процессоры
+    (user, perms) лениво обращаются к базе
+    """
     template_name = 'shopapp/products-details.html'
-    # model = Product
-    queryset = Product.objects.prefetch_related('images')
-    context_object_name = 'product'
+    # картинки подгружает шаблон только при промахе кэша фрагмента
+    queryset = Product.objects.all()
+
+    async def get(self, request: HttpRequest, pk: int) -> HttpResponse:
+        try:
+            product = await self.queryset.aget(pk=pk)
+        except Product.DoesNotExist:
+            raise Http404
+        return await sync_to_async(render)(request, self.template_name, {'product': product})
 
 
-class ProductsListView(ListView):
+class ProductsListView(View):
+    """
+    Список товаров по страницам с keyset-пагинацией: ссылка "load more"
+    передаёт cursor с ключом сортировки последнего товара страницы.
+    Выбираются только колонки шаблона и имя автора, страница - один запрос
+    """
     template_name = 'shopapp/products-list.html'
-    # model = Product
-    context_object_name = 'products'
-    queryset = Product.objects.filter(archived=False)
+    paginate_by = 20
+    ordering = ['name', 'price', 'pk']
+    queryset = (
+        Product.objects
+        .filter(archived=False)
+        .only('pk', 'name', 'price', 'discount', 'preview', 'updated_at')
+        .annotate(created_by_name=Coalesce(NullIf('created_by__first_name', Value('')), 'created_by__username'))
+    )
+
+    async def get(self, request: HttpRequest) -> HttpResponse:
+        paginator = KeysetOrPageNumberPagination()
+        queryset = self.queryset.order_by(*self.ordering)
+        cursor = request.GET.get(paginator.cursor_query_param)
+        if cursor:
+            try:
+                queryset = queryset.filter(
+                    paginator.build_filter(Product, self.ordering, paginator.decode_cursor(cursor))
+                )
+            except ValidationError:
+                return HttpResponseBadRequest('Invalid cursor')
+
+        products = [product async for product in queryset[:self.paginate_by + 1]]
+        next_cursor = None
+        if len(products) > self.paginate_by:
+            products = products[:self.paginate_by]
+            next_cursor = paginator.encode_cursor(Product, self.ordering, products[-1])
+        context = {
+            'products': products,
+            'next_cursor': next_cursor,
+        }
+        return await sync_to_async(render)(request, self.template_name, context)
 
 
 class ProductCreateView(UserPassesTestMixin, CreateView):
@@ -277,24 +456,52 @@ class ProductDeleteView(DeleteView):
         return HttpResponseRedirect(success_url)
 
 
+def products_export_etag(request: HttpRequest) -> str:
+    return f'products-export-{get_version(PRODUCTS_VERSION)}'
+
+
 class ProductsDataExportView(View):
-    def get(self, request: HttpRequest) -> JsonResponse:
-        cache_key = 'products_data_export'
-        products_data = cache.get(cache_key)
-        if products_data is None:
-            products = Product.objects.order_by('pk').all()
-            products_data = [
-                {
-                    'pk': product.pk,
-                    'name': product.name,
-                    'price': product.price,
-                    'archived': product.archived,
-                    'created_by': product.created_by.id
-                }
-                for product in products
-            ]
-        cache.set(cache_key, products_data, 300)
-        return JsonResponse({'products': products_data})
+    """
+    Выгрузка товаров в JSON.
+    Снимок кэшируется под текущей версией каталога, которую меняют
+    сигналы сохранения и удаления Product, поэтому данные не устаревают.
+    Выгрузка больше snapshot_max_size символов не кэшируется,
+    чтобы не держать её целиком в памяти
+    """
+    fields = ('pk', 'name', 'price', 'archived', 'created_by')
+    snapshot_timeout = 60 * 60 * 24
+    snapshot_max_size = 4 * 1024 * 1024
+
+    def iter_snapshot(self, cache_key: str):
+        rows = (
+            Product.objects
+            .order_by('pk')
+            .values_list('pk', 'name', 'price', 'archived', 'created_by_id')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        parts = []
+        size = 0
+        for part in iter_json_list('products', (dict(zip(self.fields, row)) for row in rows)):
+            if parts is not None:
+                size += len(part)
+                if size > self.snapshot_max_size:
+                    # дальше выгрузка только отдаётся клиенту
+                    parts = None
+                else:
+                    parts.append(part)
+            yield part
+        if parts is not None:
+            cache.set(cache_key, ''.join(parts), self.snapshot_timeout)
+
+    @method_decorator(etag(products_export_etag))
+    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        cache_key = f'products_data_export_{get_version(PRODUCTS_VERSION)}'
+        snapshot = cache.get(cache_key)
+        if snapshot is None:
+            content = self.iter_snapshot(cache_key)
+        else:
+            content = [snapshot]
+        return StreamingHttpResponse(stream_parts(request, content), content_type='application/json')
 
 
 class LatestProductsFeed(Feed):
@@ -331,10 +538,15 @@ class LatestProductsFeed(Feed):
 
 
 class OrdersListView(LoginRequiredMixin, ListView):
+    # товары подгружает шаблон только для строк, которых нет в кэше фрагментов.
+    # Версия строки - updated_at заказа (меняется с составом) и последний
+    # updated_at его товаров (названия и цены), запись чужого товара её не меняет
     queryset = (
         Order.objects
         .select_related('user')
-        .prefetch_related('products')
+        .only('pk', 'updated_at', 'promocode', 'delivery_address', 'items_count', 'total',
+              'user__first_name', 'user__username')
+        .annotate(products_updated_at=Max('products__updated_at'))
     )
 
 
@@ -370,21 +582,29 @@ class OrderDeleteView(DeleteView):
 
 
 class OrdersDataExportView(View):
+    """
+    Потоковая выгрузка заказов.
+    ?format=ndjson отдаёт по одному заказу в строке, по умолчанию {"orders": [...]}.
+    ?since_id=N продолжает выгрузку с заказов, у которых id больше N
+    """
+    batch_size = EXPORT_CHUNK_SIZE
+
     def dispatch(self, request, *args, **kwargs):
         if not request.user.is_staff:
             return HttpResponse('У вас недостаточно прав')
         return super().dispatch(request, *args, **kwargs)
 
-    def get(self, request: HttpRequest) -> JsonResponse:
-        orders = Order.objects.all()
-        orders_data = [
-            {
-                'id': order.id,
-                'delivery_address': order.delivery_address,
-                'promocode': order.promocode,
-                'user_id': order.user_id,
-                'products_id': [product.id for product in order.products.all()],
-            }
-            for order in orders
-        ]
-        return JsonResponse({'orders': orders_data})
+    def get(self, request: HttpRequest) -> HttpResponse:
+        queryset = Order.objects.all()
+        since_id = request.GET.get('since_id')
+        if since_id is not None:
+            if not since_id.isdigit():
+                return HttpResponseBadRequest('since_id must be a positive integer')
+            queryset = queryset.filter(pk__gt=int(since_id))
+
+        orders_data = iter_orders_data(queryset, batch_size=self.batch_size)
+        if request.GET.get('format') == 'ndjson':
+            content, content_type = iter_ndjson(orders_data), 'application/x-ndjson'
+        else:
+            content, content_type = iter_json_list('orders', orders_data), 'application/json'
+        return StreamingHttpResponse(stream_parts(request, content), content_type=content_type)